@@ -0,0 +1,164 @@
+from __future__ import unicode_literals, print_function
+
+import datetime
+import hashlib
+import json
+import os
+import zlib
+
+# autosaves are stored by content: each file's data is compressed into
+# objects/ under its sha1, and each autosave is a manifest in manifests/,
+# named for when it was made, of which object each file had:
+#
+#     {"life": "3f786850e3...", "logs/index": "89e6c98d92...", ...}
+#
+# so a file that didn't change since the last autosave costs nothing more.
+# thin() drops older manifests, and then any objects none of the rest use.
+
+manifest_format = "%Y-%m-%dT%H.%M.%S"
+
+
+class AutosaveStore(object):
+    # keep every autosave for this long, then the newest of each hour for
+    # keep_hourly, and the newest of each day after that
+    keep_all = datetime.timedelta(hours=1)
+    keep_hourly = datetime.timedelta(days=1)
+
+    def __init__(self, path):
+        self.path = path
+        self.objects_path = os.path.join(path, "objects")
+        self.manifests_path = os.path.join(path, "manifests")
+        # full path -> (size, mtime, sha1) of files as last added, so that
+        # unchanged ones aren't read again
+        self._hashes = {}
+
+    def manifests(self):
+        """
+        Names of the autosaves, oldest first.
+        """
+        if not os.path.exists(self.manifests_path):
+            return []
+        return sorted(filename[:-len(".json")]
+                for filename in os.listdir(self.manifests_path)
+                if filename.endswith(".json"))
+
+    def read_manifest(self, name):
+        path = os.path.join(self.manifests_path, name + ".json")
+        with open(path, "r") as reader:
+            return json.loads(reader.read())
+
+    def add(self, source_dir, paths, when):
+        """
+        Autosave paths in source_dir (files, or directories of files) as
+        of when. Returns the name of the autosave.
+        """
+        manifest = {}
+        for path in paths:
+            full_path = os.path.join(source_dir, path)
+            if os.path.isdir(full_path):
+                for filename in os.listdir(full_path):
+                    manifest[path + "/" + filename] = self._add_file(
+                            os.path.join(full_path, filename))
+            elif os.path.exists(full_path):
+                manifest[path] = self._add_file(full_path)
+
+        name = when.strftime(manifest_format)
+        self._write(os.path.join(self.manifests_path, name + ".json"),
+                json.dumps(manifest, sort_keys=True))
+        return name
+
+    def _add_file(self, full_path):
+        stat = os.stat(full_path)
+        known = self._hashes.get(full_path)
+        if known is not None and known[:2] == (stat.st_size, stat.st_mtime):
+            return known[2]
+
+        with open(full_path, "rb") as reader:
+            data = reader.read()
+        sha1 = hashlib.sha1(data).hexdigest().decode("ascii")
+        object_path = self._object_path(sha1)
+        if not os.path.exists(object_path):
+            self._write(object_path, zlib.compress(data, 1))
+        self._hashes[full_path] = stat.st_size, stat.st_mtime, sha1
+        return sha1
+
+    def _object_path(self, sha1):
+        return os.path.join(self.objects_path, sha1[:2], sha1[2:])
+
+    def _write(self, path, data):
+        directory = os.path.dirname(path)
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        temp_path = path + ".tmp"
+        with open(temp_path, "wb") as writer:
+            writer.write(data)
+        if os.name == "nt" and os.path.exists(path):
+            os.remove(path)
+        os.rename(temp_path, path)
+
+    def find(self, prefix=""):
+        """
+        The newest autosave whose name starts with prefix, or None.
+        """
+        for name in reversed(self.manifests()):
+            if name.startswith(prefix):
+                return name
+        return None
+
+    def restore(self, name, target_dir):
+        """
+        Write the files of autosave name into target_dir. Files that were
+        in a directory it saved, but that it doesn't have, are removed.
+        """
+        manifest = self.read_manifest(name)
+        for path, sha1 in manifest.items():
+            with open(self._object_path(sha1), "rb") as reader:
+                data = zlib.decompress(reader.read())
+            self._write(os.path.join(target_dir, path), data)
+
+        directories = set(path.rpartition("/")[0] for path in manifest)
+        for directory in directories - set([""]):
+            full_path = os.path.join(target_dir, directory)
+            for filename in os.listdir(full_path):
+                if directory + "/" + filename not in manifest:
+                    os.remove(os.path.join(full_path, filename))
+        return manifest
+
+    def thin(self, now):
+        """
+        Remove autosaves that the retention policy doesn't keep as of now,
+        and objects that no remaining autosave uses.
+        """
+        kept = []
+        removed = False
+        seen = set()
+        for name in reversed(self.manifests()):
+            when = datetime.datetime.strptime(name, manifest_format)
+            age = now - when
+            if age < self.keep_all:
+                bucket = name
+            elif age < self.keep_hourly:
+                bucket = when.strftime("%Y-%m-%dT%H")
+            else:
+                bucket = when.strftime("%Y-%m-%d")
+            if bucket in seen:
+                os.remove(os.path.join(self.manifests_path, name + ".json"))
+                removed = True
+            else:
+                seen.add(bucket)
+                kept.append(name)
+
+        if removed:
+            self._collect_garbage(kept)
+
+    def _collect_garbage(self, names):
+        used = set()
+        for name in names:
+            used.update(self.read_manifest(name).values())
+        if not os.path.exists(self.objects_path):
+            return
+        for prefix in os.listdir(self.objects_path):
+            directory = os.path.join(self.objects_path, prefix)
+            for rest in os.listdir(directory):
+                if prefix + rest not in used:
+                    os.remove(os.path.join(directory, rest))
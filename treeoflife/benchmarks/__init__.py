@@ -0,0 +1,119 @@
+"""
+Benchmarks for the slow paths of the tracker. These are not run as part of
+the test suite; run one with, for instance:
+
+    python -m treeoflife.benchmarks.parse
+"""
+from __future__ import unicode_literals, print_function
+
+import datetime
+import random
+import string
+import time
+
+from treeoflife import timefmt
+
+
+_idchars = string.ascii_letters + string.digits
+
+
+def _make_id(counter):
+    result = []
+    for x in range(5):
+        counter, index = divmod(counter, len(_idchars))
+        result.append(_idchars[index])
+    return "".join(result)
+
+
+def generate_life(target_lines=60000, seed=0):
+    """
+    Produce the text of a life file that looks roughly like a real one:
+    a long run of days full of tasks and comments, a handful of categories
+    with nested projects, and a todo bucket. Stops once at least
+    target_lines lines have been produced.
+    """
+    rand = random.Random(seed)
+    ids = iter(xrange(1000, 10 ** 9))
+    lines = []
+
+    def node(indent, node_type, text=None):
+        line = "    " * indent + "%s#%s" % (node_type, _make_id(next(ids)))
+        if text is not None:
+            line += ": " + text
+        lines.append(line)
+
+    def option(indent, name, value=None):
+        line = "    " * (indent + 1) + "@" + name
+        if value is not None:
+            line += ": " + value
+        lines.append(line)
+
+    def words(count):
+        return " ".join(rand.choice(("fix", "write", "the", "parser",
+            "review", "tree", "benchmark", "email", "groceries", "call",
+            "plan", "read", "notes", "on", "for", "with"))
+            for x in range(count))
+
+    def task(indent, dt, node_type="task"):
+        node(indent, node_type, words(rand.randint(2, 7)))
+        option(indent, "started", timefmt.datetime_to_str(dt))
+        if rand.random() < 0.8:
+            option(indent, "finished", timefmt.datetime_to_str(
+                dt + datetime.timedelta(minutes=rand.randint(5, 90))))
+        if rand.random() < 0.3:
+            lines.append("    " * (indent + 1) + "- " + words(8))
+        if rand.random() < 0.4:
+            node(indent + 1, "comment", words(rand.randint(3, 12)))
+
+    categories = []
+    for x in range(8):
+        categories.append(words(2))
+
+    lines.append("days#00001")
+    date = datetime.date.today() - datetime.timedelta(days=1)
+    day_lines = target_lines * 3 // 4
+    day_chunks = []
+    while sum(len(chunk) for chunk in day_chunks) < day_lines:
+        dt = datetime.datetime.combine(date, datetime.time(8, 0))
+        chunk_start = len(lines)
+        node(1, "day", timefmt.date_to_str(date))
+        option(1, "started", timefmt.datetime_to_str(dt))
+        for x in range(rand.randint(5, 25)):
+            task(2, dt + datetime.timedelta(minutes=x * 20))
+        day_chunks.append(lines[chunk_start:])
+        del lines[chunk_start:]
+        date -= datetime.timedelta(days=1)
+    for chunk in reversed(day_chunks):
+        lines.extend(chunk)
+
+    while len(lines) < target_lines:
+        node(0, "category", rand.choice(categories))
+        for x in range(rand.randint(3, 10)):
+            node(1, "project", words(3))
+            for y in range(rand.randint(3, 15)):
+                task(2, datetime.datetime(2014, 1, 1, 9, 0))
+
+    lines.append("todo bucket#" + _make_id(next(ids)))
+    for x in range(50):
+        node(1, "todo", words(6))
+
+    return "\n".join(lines) + "\n"
+
+
+def best_of(func, repeat=3):
+    """
+    Run func() repeat times, and return the fastest wall-clock duration.
+    """
+    results = []
+    for x in range(repeat):
+        started = time.time()
+        func()
+        results.append(time.time() - started)
+    return min(results)
+
+
+def report(name, seconds, baseline=None):
+    message = "%-40s %9.3fs" % (name, seconds)
+    if baseline is not None and seconds:
+        message += "  (%.1fx)" % (baseline / seconds)
+    print(message)
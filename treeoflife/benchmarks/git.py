@@ -0,0 +1,50 @@
+"""
+Compare committing a save with git add and git commit, a process each,
+against writing it to one long lived git fast-import.
+"""
+from __future__ import unicode_literals, print_function
+
+import os
+import shutil
+import sys
+import tempfile
+
+from treeoflife.tracker import Tracker
+from treeoflife.userinterface import Git, FastImportGit
+from treeoflife.benchmarks import generate_life, best_of, report
+
+paths = ["config.json", "life", "logs", "log", ".gitignore"]
+
+
+def main(lines=60000, saves=10):
+    tracker = Tracker(skeleton=False)
+    tracker.deserialize({"life": generate_life(lines)})
+    save_dir = tempfile.mkdtemp()
+    try:
+        tracker.save(save_dir)
+        life_path = os.path.join(save_dir, "life")
+
+        def saving(git):
+            def run():
+                for x in range(saves):
+                    with open(life_path, "a") as writer:
+                        writer.write(b"task: another\n")
+                    git.save(paths, "Full save")
+            return run
+
+        git = Git(save_dir)
+        git.init()
+        git.gitignore(["_*"])
+        separate = best_of(saving(git))
+        report("%d saves: git add, git commit" % saves, separate)
+
+        git = FastImportGit(save_dir)
+        fast_import = best_of(saving(git))
+        git.close()
+        report("%d saves: git fast-import" % saves, fast_import, separate)
+    finally:
+        shutil.rmtree(save_dir)
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,44 @@
+"""
+Compare a full save against appending a one-node change to the journal.
+"""
+from __future__ import unicode_literals, print_function
+
+import shutil
+import sys
+import tempfile
+
+from treeoflife.tracker import Tracker
+from treeoflife.benchmarks import generate_life, best_of, report
+
+
+def main(target_lines=20000):
+    save_dir = tempfile.mkdtemp()
+    try:
+        tracker = Tracker(skeleton=False)
+        tracker.deserialize({"life": generate_life(target_lines)})
+        tracker.save_journal(save_dir)
+        nodes = [node for depth, node in tracker.root.iter_flat_children()
+                if node.node_type == "task"]
+        print("%d tasks" % len(nodes))
+
+        full = best_of(lambda: tracker.save(save_dir))
+        report("save: full", full)
+
+        def change_and_save():
+            node = nodes[len(nodes) // 2]
+            node.text = node.text + "!"
+            tracker.save_journal(save_dir)
+
+        tracker.save(save_dir)
+        journaled = best_of(change_and_save)
+        report("save: journal", journaled, full)
+
+        loaded = Tracker(skeleton=False)
+        loaded.load(save_dir)
+        assert loaded.serialize()["life"] == tracker.serialize()["life"]
+    finally:
+        shutil.rmtree(save_dir)
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,71 @@
+"""
+Compare the original activation log format against the compact one, and
+writing and reading the whole log as one file against the log store,
+which appends new entries and reads the newest month.
+"""
+from __future__ import unicode_literals, print_function
+
+import datetime
+import random
+import shutil
+import sys
+import tempfile
+
+from treeoflife import file_storage
+from treeoflife.logstore import LogStore, EventLog
+from treeoflife.benchmarks import best_of, report
+
+
+def generate_log(count, seed=0):
+    rand = random.Random(seed)
+    date = datetime.datetime(2011, 1, 1)
+    log = []
+    for x in range(count):
+        date += datetime.timedelta(minutes=rand.randint(1, 60))
+        path = [("00000", "life", None), ("days0", "days", None),
+                ("d%04d" % (x // 40), "day", date.strftime("%B %d, %Y")),
+                ("t%04d" % rand.randint(0, 9999), "task",
+                    "some task %d" % rand.randint(0, 99))]
+        log.append((path, rand.choice(["activation", "jump"]), date))
+    return log
+
+
+def main(count=100000):
+    entries = generate_log(count)
+    print("%d entries, %s to %s" % (count, entries[0][2].date(),
+        entries[-1][2].date()))
+    store_dir = tempfile.mkdtemp()
+    try:
+        store = LogStore(store_dir)
+        store.append(entries[:-1])
+        data = file_storage.dump_log(entries)
+
+        def save_whole():
+            file_storage.dump_log(entries)
+        whole = best_of(save_whole)
+        report("save: whole log", whole)
+        compact = best_of(lambda: file_storage.dump_log(entries,
+            compact=True))
+        report("save: whole log, compact", compact, whole)
+
+        log = EventLog.load(store)
+
+        def save_store():
+            log.append(entries[-1])
+            log.save(store)
+        appended = best_of(save_store)
+        report("save: append to store", appended, whole)
+
+        whole = best_of(lambda: file_storage.load_log(data))
+        report("load: whole log", whole)
+        compact_data = file_storage.dump_log(entries, compact=True)
+        compact = best_of(lambda: file_storage.load_log(compact_data))
+        report("load: whole log, compact", compact, whole)
+        recent = best_of(lambda: EventLog.load(LogStore(store_dir)))
+        report("load: newest segment", recent, whole)
+    finally:
+        shutil.rmtree(store_dir)
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,51 @@
+"""
+Compare the compiled line tokenizer against the original state machine,
+both on raw lines and when parsing straight from an open file.
+"""
+from __future__ import unicode_literals, print_function
+
+import io
+import sys
+
+from treeoflife import file_storage
+from treeoflife.benchmarks import generate_life, best_of, report
+
+
+def _legacy_parse(text):
+    lines = list(text.split("\n"))
+    for index, line in enumerate(lines):
+        if index == len(lines) - 1 and not line:
+            continue
+        yield file_storage._parse_line_slow(line)
+
+
+def main(target_lines=60000):
+    text = generate_life(target_lines)
+    lines = text.split("\n")
+    print("%d lines" % len(lines))
+
+    legacy = best_of(lambda: list(_legacy_parse(text)))
+    report("tokenize: state machine", legacy)
+    compiled = best_of(lambda: [file_storage.parse_line(line)
+                                for line in lines])
+    report("tokenize: compiled", compiled, legacy)
+
+    assert list(_legacy_parse(text)) == list(file_storage.parse_string(text))
+
+    encoded = text.encode("utf-8")
+
+    def read_legacy():
+        reader = io.BytesIO(encoded)
+        return list(_legacy_parse(reader.read().decode("utf-8")))
+
+    def read_streaming():
+        return list(file_storage.FileParser(io.BytesIO(encoded)))
+
+    legacy = best_of(read_legacy)
+    report("file: read, state machine", legacy)
+    streaming = best_of(read_streaming)
+    report("file: streaming, compiled", streaming, legacy)
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,43 @@
+"""
+Compare serializing every node against serialize_to_str() after a
+one-node change, which reuses what it made for the rest of the tree.
+"""
+from __future__ import unicode_literals, print_function
+
+import sys
+
+from treeoflife.tracker import Tracker
+from treeoflife import file_storage
+from treeoflife.benchmarks import generate_life, best_of, report
+
+
+def main(target_lines=20000):
+    tracker = Tracker(skeleton=False)
+    tracker.deserialize({"life": generate_life(target_lines)})
+    root = tracker.root
+    nodes = [node for depth, node in root.iter_flat_children()
+            if node.node_type == "task"]
+    print("%d tasks" % len(nodes))
+
+    def uncached():
+        return "\n".join(file_storage.serialize(root, is_root=True)) + "\n"
+    full = best_of(uncached)
+    report("serialize: every node", full)
+
+    def change_and_serialize():
+        node = nodes[len(nodes) // 2]
+        node.text = node.text + "!"
+        return file_storage.serialize_to_str(root)
+
+    file_storage.serialize_to_str(root)
+    cached = best_of(change_and_serialize)
+    report("serialize: after one change", cached, full)
+
+    unchanged = best_of(lambda: file_storage.serialize_to_str(root))
+    report("serialize: unchanged", unchanged, full)
+
+    assert file_storage.serialize_to_str(root) == uncached()
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,41 @@
+"""
+Compare loading a save directory from the text life file against loading
+it from the binary snapshot written next to it.
+"""
+from __future__ import unicode_literals, print_function
+
+import shutil
+import sys
+import tempfile
+
+from treeoflife.tracker import Tracker
+from treeoflife.benchmarks import generate_life, best_of, report
+
+
+def main(target_lines=20000):
+    save_dir = tempfile.mkdtemp()
+    try:
+        tracker = Tracker(skeleton=False)
+        tracker.deserialize({"life": generate_life(target_lines)})
+        files = tracker.save(save_dir)
+        print("%d lines" % files["life"].count("\n"))
+
+        def load():
+            Tracker(skeleton=False).load(save_dir)
+
+        text = best_of(load, repeat=3)
+        report("load: text", text)
+
+        tracker.save_snapshot(save_dir, files["life"])
+        snapshot = best_of(load, repeat=3)
+        report("load: snapshot", snapshot, text)
+
+        loaded = Tracker(skeleton=False)
+        loaded.load(save_dir)
+        assert loaded.serialize()["life"] == files["life"]
+    finally:
+        shutil.rmtree(save_dir)
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -1,10 +1,14 @@
 from __future__ import unicode_literals, print_function
 
+import re
+import sys
 import string
 import json
 import datetime
+import hashlib
+import marshal
 
-from treeoflife.exceptions import LoadError
+from treeoflife.exceptions import LoadError, ErrorContext
 from treeoflife.util import HandlerDict
 
 
@@ -12,7 +16,54 @@ from treeoflife.util import HandlerDict
 nodeidchars = unicode(string.letters + string.digits)
 
 
+_line_re = re.compile(r"""
+    (?P<indent>[ ]*)(?![ ])
+    (?:
+        -(?:[ ](?P<continued>.+)?)?
+      | (?!-)(?P<metadata>@)?(?P<type>[^:#]*)
+        (?:\#(?P<id>[%s]{5}))?
+        (?::(?:[ ](?P<text>.+)?)?)?
+    )
+    \Z
+""" % re.escape(nodeidchars), re.VERBOSE | re.DOTALL | re.UNICODE)
+
+
 def parse_line(line):
+    """
+    Tokenize one line of a life file into
+    (indent, is_metadata, id, node_type, text).
+
+    Well-formed lines are matched by a single compiled regex; anything the
+    regex rejects is handed to the character-at-a-time state machine, which
+    produces the error messages.
+    """
+    assert type(line) == unicode
+
+    if line[-1:] == u"\n":
+        line = line[:-1]
+    if u"\n" in line:  # pragma: no cover
+        return _parse_line_slow(line)
+
+    if line.strip() == u"":
+        return 0, False, None, u"", None
+
+    match = _line_re.match(line)
+    if match is None:
+        return _parse_line_slow(line)
+
+    indent, continued, is_metadata, node_type, id, text = match.group(
+            "indent", "continued", "metadata", "type", "id", "text")
+    indent = len(indent)
+    if indent % 4 != 0 or (is_metadata and id is not None):
+        return _parse_line_slow(line)
+    indent = indent / 4.0
+
+    if node_type is None:
+        return indent, False, None, u"-", continued
+    return indent, is_metadata is not None, id, node_type, text
+
+
+def _parse_line_slow(line):
     assert type(line) == unicode
 
     parsing_indent = 0
@@ -104,9 +155,14 @@ def parse_string(string):
 
 
 class FileParser(object):
+    """
+    Iterable of parsed lines. reader can be anything that yields lines,
+    including an open file; lines are pulled from it one at a time rather
+    than read up front.
+    """
     def __init__(self, reader, decode=True):
         self.reader = reader
-        self.error_context = None
+        self.error_context = ErrorContext()
         self.decode = decode
 
     def __iter__(self):
@@ -114,17 +170,91 @@ class FileParser(object):
 
 
 def parse_file(reader, error_context, decode=True):
-    reader = list(reader)
-    for index, line in enumerate(reader):
+    # one line of lookahead, so that a trailing empty line (as produced by
+    # splitting a string that ends with a newline) can be dropped without
+    # reading the whole input first
+    iterator = iter(reader)
+    try:
+        pending = next(iterator)
+    except StopIteration:
+        return
+
+    index = 0
+    for line in iterator:
         error_context.line = index
         if decode:
-            line = line.decode("utf-8")
-        if index == len(reader) - 1 and not line:
-            continue
-        yield parse_line(line)
-
+            pending = pending.decode("utf-8")
+        yield parse_line(pending)
+        pending = line
+        index += 1
+
+    error_context.line = index
+    if decode:
+        pending = pending.decode("utf-8")
+    if pending:
+        yield parse_line(pending)
+
+
+class ParallelParser(object):
+    """
+    Iterable of parsed lines of text, like parse_string(), but tokenized in
+    a process pool. Each line is tokenized on its own, so the text is cut
+    into batches of about the same number of lines, and tokens come back
+    in order. Uses pool if given, and otherwise one of processes (by
+    default, one per cpu) that lasts for the parse.
+    """
+    batches_per_process = 4
+
+    def __init__(self, text, pool=None, processes=None):
+        assert type(text) == unicode
+        self.text = text
+        self.pool = pool
+        self.processes = processes
+        self.error_context = ErrorContext()
 
-def serialize(tree, is_root=False, one_line=False):
+    def __iter__(self):
+        import multiprocessing
+
+        lines = self.text.split("\n")
+        if lines and not lines[-1]:
+            lines.pop()
+
+        pool = self.pool
+        if pool is None:
+            pool = multiprocessing.Pool(self.processes)
+        try:
+            size = len(lines) // (self.batches_per_process *
+                    (self.processes or multiprocessing.cpu_count())) + 1
+            batches = [(start, lines[start:start + size])
+                    for start in range(0, len(lines), size)]
+            results = pool.imap(_tokenize_batch, ["\n".join(batch)
+                    .encode("utf-8") for start, batch in batches])
+            error_context = self.error_context
+            for start, batch in batches:
+                try:
+                    tokens = marshal.loads(next(results))
+                except LoadError:
+                    # tokenize it again here, to find the line it's on
+                    for index, line in enumerate(batch, start):
+                        error_context.line = index
+                        parse_line(line)
+                    raise
+                for index, token in enumerate(tokens, start):
+                    error_context.line = index
+                    yield token
+        finally:
+            if self.pool is None:
+                pool.terminate()
+
+
+def _tokenize_batch(data):
+    # runs in the pool; marshal is much faster than the pickling that
+    # multiprocessing would do on the tokens
+    return marshal.dumps([parse_line(line)
+            for line in data.decode("utf-8").split("\n")])
+
+
+def serialize(tree, is_root=False, one_line=False, children=True):
     lines = []
     if is_root:
         indent = u""
@@ -151,53 +281,368 @@ def serialize(tree, is_root=False, one_line=False):
         else:
             lines.append(u"%s@%s: %s" % (indent, name, value))
 
+    if not children:
+        return lines
+
+    if tree.unloaded is not None:
+        for token in tree.unloaded:
+            lines.append(indent + format_token(token))
+        return lines
+
     for child in tree.children_export():
         for line in serialize(child):
             lines.append(indent + line)
     return lines
 
 
+def format_token(token):
+    """
+    The line a token was parsed from, in the form serialize() writes it.
+    """
+    indent, is_metadata, nodeid, node_type, text = token
+    if node_type == u"-" and not is_metadata:
+        line = u"- %s" % (text or u"")
+    else:
+        if is_metadata:
+            line = u"@%s" % node_type
+        elif nodeid is not None:
+            line = u"%s#%s" % (node_type, nodeid)
+        else:
+            line = node_type
+        if text is not None:
+            line += u": %s" % text
+    return u" " * 4 * int(indent) + line
+
+
 def serialize_to_str(root, is_root=True):
-    lines = serialize(root, is_root=is_root)
-    return u'\n'.join(lines) + u"\n"
+    text = _serialize_block(root, -1 if is_root else 0,
+            datetime.date.today())
+    return text or u"\n"
+
+
+def _serialize_block(tree, depth, today):
+    """
+    The lines of serialize(tree), indented for depth and joined, reusing
+    what was made last time for any subtree that hasn't changed (see
+    Node._dirty). Cached blocks are only good for the day they were made
+    on, since day nodes describe their date relative to today.
+    """
+    cached = tree._serialized
+    if (cached is not None and cached[0] == depth
+            and cached[1] == today):
+        return cached[2]
+
+    indent = u" " * 4 * max(depth, 0)
+    parts = [indent + line + u"\n"
+            for line in serialize(tree, is_root=depth < 0, children=False)]
+    if tree.unloaded is not None:
+        for token in tree.unloaded:
+            parts.append(u"%s%s\n" % (u" " * 4 * (depth + 1),
+                format_token(token)))
+    else:
+        for child in tree.children_export():
+            parts.append(_serialize_block(child, depth + 1, today))
+
+    text = u"".join(parts)
+    tree._serialized = (depth, today, text)
+    return text
+
+
+#-------------------------------------------------#
+#                 binary snapshots                #
+#-------------------------------------------------#
+
+# a snapshot is the token stream of a life file, as parse_line would produce
+# it, plus already-decoded option values, so loading it skips both the
+# tokenizer and the option grammars. it is only valid for the exact life
+# file it was made from, which is checked by hash.
+
+snapshot_magic = b"treeoflife-snapshot 1 py%d.%d\n" % sys.version_info[:2]
+
+
+def encode_value(value):
+    """
+    Convert an option attribute value to something marshal can store.
+    Raises TypeError for values that can't be represented.
+    """
+    if value is None or isinstance(value, (unicode, bool, int, long, float)):
+        return value
+    if isinstance(value, datetime.datetime):
+        return (u"datetime", value.year, value.month, value.day, value.hour,
+                value.minute, value.second, value.microsecond)
+    if isinstance(value, datetime.date):
+        return (u"date", value.year, value.month, value.day)
+    if isinstance(value, datetime.time):
+        return (u"time", value.hour, value.minute, value.second,
+                value.microsecond)
+    if isinstance(value, datetime.timedelta):
+        return (u"timedelta", value.days, value.seconds, value.microseconds)
+    raise TypeError("can't encode %r for a snapshot" % (value,))
+
+
+_value_types = {
+    u"datetime": datetime.datetime,
+    u"date": datetime.date,
+    u"time": datetime.time,
+    u"timedelta": datetime.timedelta,
+}
+
+
+def decode_value(raw):
+    if type(raw) is tuple:
+        return _value_types[raw[0]](*raw[1:])
+    return raw
+
+
+class RestoredValue(unicode):
+    """
+    Text of an option line loaded from a snapshot. .raw is the option's
+    encoded value, which Node.setoption hands to the option handler's
+    restore() instead of parsing the text.
+    """
+    raw = None
+
+
+def snapshot_records(tree, is_root=True):
+    """
+    The tokens parse_string(serialize_to_str(tree)) would produce, each with
+    a sixth field holding the encoded option value (or None), generated
+    directly from the tree.
+    """
+    records = []
+    _snapshot_records(tree, -1 if is_root else 0, records)
+    return records
+
+
+def _snapshot_records(tree, depth, records):
+    option_depth = float(depth + 1)
+    if depth >= 0:
+        if tree.node_type == u"":
+            records.append((0, False, None, u"", None, None))
+        elif tree.text:
+            text_lines = tree.text.split("\n")
+            records.append((float(depth), False, tree.id, tree.node_type,
+                    text_lines[0] or None, None))
+            for line in text_lines[1:]:
+                records.append((option_depth, False, None, u"-",
+                        line or None, None))
+        else:
+            records.append((float(depth), False, tree.id, tree.node_type,
+                    None, None))
+    else:
+        option_depth = 0.0
+
+    handlers = tree._option_dict()
+    for name, value, show in tree.option_values():
+        if not show:
+            continue
+        if value is not None:
+            value = u"%s" % value
+        raw = None
+        handler = handlers.get(name)
+        if value and hasattr(handler, "snapshot"):
+            try:
+                raw = handler.snapshot(tree)
+            except TypeError:
+                raw = None
+        records.append((option_depth, True, None, name, value or None, raw))
+
+    if tree.unloaded is not None:
+        for token in tree.unloaded:
+            records.append((float(depth + 1 + token[0]),) + token[1:]
+                    + (None,))
+        return
+
+    for child in tree.children_export():
+        _snapshot_records(child, depth + 1, records)
+
 
+def life_hash(life_bytes):
+    return hashlib.sha1(life_bytes).hexdigest().decode("ascii")
 
-def dump_log(log):
+
+def dump_snapshot(root, life_data):
+    checksum = life_hash(life_data.encode("utf-8"))
+    return snapshot_magic + marshal.dumps((checksum, snapshot_records(root)))
+
+
+def load_snapshot(data, life_bytes):
+    """
+    Returns a parser for the snapshot in data, or None if data isn't a
+    snapshot of life_bytes.
+    """
+    if not data.startswith(snapshot_magic):
+        return None
+    try:
+        checksum, records = marshal.loads(data[len(snapshot_magic):])
+    except (ValueError, EOFError, TypeError):
+        return None
+    if checksum != life_hash(life_bytes):
+        return None
+    return SnapshotParser(records)
+
+
+class SnapshotParser(object):
+    def __init__(self, records):
+        self.records = records
+        self.error_context = ErrorContext()
+
+    def __iter__(self):
+        error_context = self.error_context
+        for index, record in enumerate(self.records):
+            error_context.line = index
+            indent, is_metadata, id, node_type, text, raw = record
+            if raw is not None:
+                text = RestoredValue(text)
+                text.raw = raw
+            yield indent, is_metadata, id, node_type, text
+
+
+#-------------------------------------------------#
+#                 activation log                  #
+#-------------------------------------------------#
+
+# a log entry is one line. the original format, still what dump_log()
+# writes by default, is
+#
+#     2014-08-01 20:27:44 Friday - activation - ["life#00000", ...]
+#
+# and the compact one is tab separated:
+#
+#     2014-08-01 20:27:44<tab>activation<tab>2<tab>day#Nf01s: July 31...
+#
+# where the number is how many path items are the same as the previous
+# entry's, and only the rest are written out, with backslash escapes for
+# tabs, newlines and backslashes. load_log() reads either, line by line.
+
+_weekdays = ("Monday", "Tuesday", "Wednesday", "Thursday", "Friday",
+        "Saturday", "Sunday")
+_log_escapes = {"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r"}
+_log_unescapes = dict((value[1], key) for key, value in _log_escapes.items())
+_log_escape_re = re.compile(r"[\\\t\n\r]")
+_log_unescape_re = re.compile(r"\\(.)")
+
+
+def _format_log_date(date):
+    # isoformat() adds microseconds only when there are some
+    return date.isoformat(b" ")[:19]
+
+
+def _parse_log_day(text):
+    return datetime.datetime(int(text[0:4]), int(text[5:7]), int(text[8:10]))
+
+
+def _parse_log_time(text):
+    return datetime.timedelta(0, int(text[0:2]) * 3600 + int(text[3:5]) * 60
+            + int(text[6:8]))
+
+
+def _format_log_item(item):
+    id, type, text = item
+    if text is None:
+        return "%s#%s" % (type, id)
+    return "%s#%s: %s" % (type, id, text)
+
+
+def _parse_log_item(item):
+    type, sep, id_and_text = item.partition('#')
+    id, sep, text = id_and_text.partition(': ')
+    if sep == '':
+        text = None
+    return id, type, text
+
+
+def _escape_log_item(item):
+    item = _format_log_item(item)
+    if _log_escape_re.search(item) is None:
+        return item
+    return _log_escape_re.sub(lambda match: _log_escapes[match.group()], item)
+
+
+def _unescape_log_item(item):
+    if '\\' in item:
+        item = _log_unescape_re.sub(
+                lambda match: _log_unescapes[match.group(1)], item)
+    return _parse_log_item(item)
+
+
+def dump_log(log, compact=False):
+    if compact:
+        return _dump_log_compact(log)
     results = []
     for entry in log:
         path, event, date = entry
-        date_formatted = date.replace(microsecond=0).isoformat(b' ')
-        date_formatted += date.strftime(' %A')
-        path_formatted = []
-        for id, type, text in path:
-            if text is None:
-                item = '{}#{}'.format(type, id)
-            else:
-                item = '{}#{}: {}'.format(type, id, text)
-            path_formatted.append(item)
-        dumped_path = json.dumps(path_formatted)
+        date_formatted = "%s %s" % (_format_log_date(date),
+                _weekdays[date.weekday()])
+        dumped_path = json.dumps([_format_log_item(item) for item in path])
         result = '{} - {} - {}\n'.format(date_formatted, event, dumped_path)
         results.append(result)
     return ''.join(results)
 
 
+def _dump_log_compact(log):
+    results = []
+    previous = ()
+    items = {}
+    for path, event, date in log:
+        if path == previous:
+            shared = len(path)
+        else:
+            shared = 0
+            for item, previous_item in zip(path, previous):
+                if item != previous_item:
+                    break
+                shared += 1
+        previous = path
+
+        written = []
+        for item in path[shared:]:
+            text = items.get(item)
+            if text is None:
+                text = items[item] = _escape_log_item(item)
+            written.append(text)
+        results.append("%s\t%s\t%d\t%s\n" % (_format_log_date(date), event,
+                shared, "\t".join(written)))
+    return "".join(results)
+
+
 def load_log(data):
-    lines = data.split('\n')
     log = []
-    for line in lines:
-        if line == '':
+    append = log.append
+    previous = []
+    days = {}
+    times = {}
+    # the same items come up over and over, so they're parsed once each
+    items = {}
+    json_items = {}
+    for line in data.split('\n'):
+        if line[19:20] == '\t':
+            fields = line.split('\t')
+            path = previous[:int(fields[2])]
+            if fields[3]:
+                for item in fields[3:]:
+                    parsed = items.get(item)
+                    if parsed is None:
+                        parsed = items[item] = _unescape_log_item(item)
+                    path.append(parsed)
+            event = fields[1]
+        elif line == '':
             continue
-        date_formatted, event, dumped_path = line.split(' - ', 2)
-        path_formatted = json.loads(dumped_path)
-        path = []
-        for item in path_formatted:
-            type, sep, id_and_text = item.partition('#')
-            id, sep, text = id_and_text.partition(': ')
-            if sep == '':
-                text = None
-            path.append((id, type, text))
-        date = datetime.datetime.strptime(date_formatted,
-                '%Y-%m-%d %H:%M:%S %A')
-        entry = path, event, date
-        log.append(entry)
+        else:
+            date_formatted, event, dumped_path = line.split(' - ', 2)
+            path = []
+            for item in json.loads(dumped_path):
+                parsed = json_items.get(item)
+                if parsed is None:
+                    parsed = json_items[item] = _parse_log_item(item)
+                path.append(parsed)
+        previous = path
+
+        day = days.get(line[:10])
+        if day is None:
+            day = days[line[:10]] = _parse_log_day(line[:10])
+        time = times.get(line[11:19])
+        if time is None:
+            time = times[line[11:19]] = _parse_log_time(line[11:19])
+        append((path, event, day + time))
     return log
@@ -0,0 +1,252 @@
+from __future__ import unicode_literals, print_function
+
+import logging
+import json
+
+from treeoflife.exceptions import LoadError
+from treeoflife import file_storage
+
+logger = logging.getLogger(__name__)
+
+# a journal is a file of json lines. the first names the checkpoint (the
+# life file, by hash) it applies to; each after that is a batch describing
+# everything that changed between two saves:
+#
+#     {
+#         "removed": [id, ...],
+#         "added": [{"parent": id, "index": n, "lines": [...]}, ...],
+#         "updated": [{"id": id, "lines": [...]}, ...]
+#     }
+#
+# added entries carry the whole serialized subtree, in document order, and
+# go in at their final index under their parent. updated entries carry
+# only the node's own lines (the node line, continuations and options).
+# a parent or id of None means the root. journals from before the log had
+# its own store (see logstore) may also have "log": "dumped log entries".
+
+
+def header(checksum):
+    return json.dumps({"checkpoint": checksum}) + "\n"
+
+
+def dump_batch(batch):
+    return json.dumps(batch, sort_keys=True) + "\n"
+
+
+def _export_path(root, node):
+    """
+    Indices of node and its parents among their siblings, as they'd be
+    serialized, or None if node isn't in root's serialized tree.
+    """
+    path = []
+    while node is not root:
+        parent = node.parent
+        if parent is None:
+            return None
+        try:
+            path.append(parent.children_export().index(node))
+        except ValueError:
+            return None
+        node = parent
+    path.reverse()
+    return path
+
+
+def make_batch(root, changes):
+    """
+    Describe changes (a TreeChanges) to root as a journal batch. Returns
+    None if there's nothing to write.
+    """
+    removed = []
+    for node in changes.removed:
+        if node.node_type != "" and _export_path(root, node) is None:
+            removed.append(node.id)
+
+    paths = {}
+    for node in changes.added | changes.touched:
+        path = _export_path(root, node)
+        if path is not None:
+            paths[node] = path
+
+    added = []
+    updated = []
+    for node, path in sorted(paths.items(), key=lambda item: item[1]):
+        if any(parent in changes.added and parent in paths
+                for parent in node.iter_parents() if parent is not node):
+            # written as part of a parent's subtree
+            continue
+        if node is root:
+            updated.append({"id": None, "lines": file_storage.serialize(
+                root, is_root=True, children=False)})
+        elif node in changes.added:
+            parent_id = None if node.parent is root else node.parent.id
+            added.append({"parent": parent_id, "index": path[-1],
+                "lines": file_storage.serialize(node)})
+        elif node.node_type != "":
+            updated.append({"id": node.id, "lines": file_storage.serialize(
+                node, children=False)})
+
+    batch = {}
+    if removed:
+        batch["removed"] = sorted(removed)
+    if added:
+        batch["added"] = added
+    if updated:
+        batch["updated"] = updated
+    return batch or None
+
+
+class _Line(object):
+    """
+    A node of a life file as its tokens: the node line, its own other
+    lines (continuations and options), and child _Lines.
+    """
+    def __init__(self, token):
+        self.token = token
+        self.lines = []
+        self.children = []
+        self.parent = None
+
+    @property
+    def is_empty(self):
+        return self.token is not None and self.token[3] == ""
+
+
+def _build(tokens, container, ids):
+    # assigns lines to nodes exactly the way Tracker.deserialize does
+    stack = []
+    last = container
+    lastindent = -1
+    for token in tokens:
+        indent, is_metadata, nodeid, node_type, text = token
+        if node_type == "":
+            indent = lastindent
+            if last is not None and not last.is_empty:
+                indent += 1
+        if indent > lastindent:
+            if indent > lastindent + 1:
+                raise LoadError("indented too far")
+            stack.append(last)
+        elif indent < lastindent:
+            stack = stack[:int(indent) + 1]
+        lastindent = indent
+
+        parent = stack[-1]
+        if parent is None:
+            raise LoadError("metadata in the wrong place")
+        if is_metadata or node_type == "-":
+            parent.lines.append(token)
+            last = None
+        else:
+            line = _Line(token)
+            line.parent = parent
+            parent.children.append(line)
+            if nodeid is not None:
+                ids[nodeid] = line
+            last = line
+
+
+def _parse(lines, ids):
+    container = _Line(None)
+    _build(file_storage.parse_string("\n".join(lines) + "\n"),
+            container, ids)
+    return container
+
+
+def _flatten(line, depth, records):
+    token = line.token
+    if token is not None:
+        if line.is_empty:
+            records.append(token + (None,))
+        else:
+            records.append((depth,) + token[1:] + (None,))
+    for extra in line.lines:
+        text = extra[4]
+        records.append((depth + 1,) + extra[1:] +
+                (getattr(text, "raw", None),))
+    for child in line.children:
+        _flatten(child, depth + 1, records)
+
+
+def _detach(line):
+    if line is not None and line.parent is not None:
+        line.parent.children.remove(line)
+        line.parent = None
+
+
+def _apply(batch, root, ids):
+    added = []
+    moved = set(batch.get("removed", ()))
+    for item in batch.get("added", ()):
+        subtree_ids = {}
+        container = _parse(item["lines"], subtree_ids)
+        moved.update(subtree_ids)
+        added.append((item, container.children, subtree_ids))
+
+    for nodeid in moved:
+        _detach(ids.pop(nodeid, None))
+
+    for item, lines, subtree_ids in added:
+        if item["parent"] is None:
+            parent = root
+        else:
+            parent = ids.get(item["parent"])
+            if parent is None:
+                raise LoadError("journal adds to missing node #%s"
+                        % item["parent"])
+        index = item["index"]
+        parent.children[index:index] = lines
+        for line in lines:
+            line.parent = parent
+        ids.update(subtree_ids)
+
+    for item in batch.get("updated", ()):
+        container = _parse(item["lines"], {})
+        if item["id"] is None:
+            root.lines = container.lines
+            continue
+        target = ids.get(item["id"])
+        if target is None:
+            raise LoadError("journal updates missing node #%s" % item["id"])
+        new = container.children[0]
+        target.token = new.token
+        target.lines = new.lines
+
+
+def replay(tokens, life_bytes, journal_data):
+    """
+    Apply journal_data to the life file whose contents are life_bytes and
+    which parses to tokens. Returns snapshot records for the result and the
+    log data the journal carried, or None if the journal was made against
+    a different life file.
+    """
+    entries = journal_data.split("\n")
+    try:
+        checkpoint = json.loads(entries[0])["checkpoint"]
+    except (ValueError, KeyError, TypeError):
+        checkpoint = None
+    if checkpoint != file_storage.life_hash(life_bytes):
+        return None
+
+    root = _Line(None)
+    ids = {}
+    _build(tokens, root, ids)
+
+    log = []
+    for index, entry in enumerate(entries[1:], 1):
+        if not entry:
+            continue
+        try:
+            batch = json.loads(entry)
+        except ValueError:
+            if index == len(entries) - 1:
+                # there's no newline after it, so writing it was cut short
+                logger.warning("dropping incomplete journal entry")
+                continue
+            raise LoadError("corrupt journal entry on line %d" % (index + 1))
+        _apply(batch, root, ids)
+        log.append(batch.get("log", ""))
+
+    records = []
+    _flatten(root, -1, records)
+    return records, "".join(log)
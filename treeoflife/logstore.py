@@ -0,0 +1,276 @@
+from __future__ import unicode_literals, print_function
+
+import json
+import os
+
+from treeoflife import file_storage
+
+# the activation log only ever grows, so it is stored as a directory of
+# segments, one per month (named like "2014-06"), each in the compact format
+# of file_storage.dump_log, which new entries are appended to. the index file
+# lists the segments in order with how many entries and bytes each holds:
+#
+#     {"segments": [["2014-05", 1520, 180233], ["2014-06", 311, 36807]]}
+#
+# which is enough to know the length of the whole log, and to read only
+# the segments something actually asks for. bytes past a segment's
+# recorded size are from an append that didn't finish and are ignored.
+
+
+class LogStore(object):
+    index_filename = "index"
+
+    def __init__(self, path):
+        self.path = path
+        self.segments = []
+
+        index_path = os.path.join(path, self.index_filename)
+        if os.path.exists(index_path):
+            with open(index_path, "r") as reader:
+                self.segments = [list(segment) for segment
+                        in json.loads(reader.read())["segments"]]
+
+    @classmethod
+    def exists(cls, path):
+        return os.path.exists(os.path.join(path, cls.index_filename))
+
+    @property
+    def count(self):
+        return sum(count for name, count, size in self.segments)
+
+    def read_text(self, index):
+        name, count, size = self.segments[index]
+        return self._read_text(name, size)
+
+    def _read_text(self, name, size):
+        with open(os.path.join(self.path, name), "rb") as reader:
+            return reader.read(size).decode("utf-8")
+
+    def read(self, index):
+        return file_storage.load_log(self.read_text(index))
+
+    def append(self, entries):
+        """
+        Append entries, each to the newest segment unless it is from a later
+        month, in which case it starts a new one.
+        """
+        self.write(self.encode(entries))
+
+    @staticmethod
+    def encode(entries):
+        """
+        What append() would write for entries, as (month, count, data) for
+        each run of entries that starts a month later than the one before.
+        """
+        batches = []
+        for entry in entries:
+            month = entry[2].strftime("%Y-%m")
+            if not batches or month > batches[-1][0]:
+                batches.append((month, []))
+            batches[-1][1].append(entry)
+        return [(month, len(batch),
+                    file_storage.dump_log(batch, compact=True).encode("utf-8"))
+                for month, batch in batches]
+
+    def write(self, batches):
+        """
+        Append batches from encode().
+        """
+        if not batches:
+            return
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+
+        for month, count, data in batches:
+            if not self.segments or month > self.segments[-1][0]:
+                self.segments.append([month, 0, 0])
+            segment = self.segments[-1]
+            with open(os.path.join(self.path, segment[0]), "ab") as writer:
+                writer.truncate(segment[2])
+                writer.write(data)
+            segment[1] += count
+            segment[2] += len(data)
+        self._write_index()
+
+    def clear(self):
+        for name, count, size in self.segments:
+            os.remove(os.path.join(self.path, name))
+        self.segments = []
+        self._write_index()
+
+    def _write_index(self):
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+        index_path = os.path.join(self.path, self.index_filename)
+        temp_path = index_path + ".tmp"
+        with open(temp_path, "w") as writer:
+            writer.write(json.dumps({"segments": self.segments}))
+        if os.name == "nt" and os.path.exists(index_path):
+            os.remove(index_path)
+        os.rename(temp_path, index_path)
+
+
+class EventLog(object):
+    """
+    The activation log (see TreeRootNode): a sequence of entries, oldest
+    first, whose older entries may still be on disk in a LogStore. Those are
+    read a segment at a time, newest first, when something reaches back far
+    enough to need them; reversed() only reads as far as it's iterated.
+
+    Writes to the store may happen later on another thread (see
+    pending_save), so dump() only reads segments as they were when the log
+    was loaded, and otherwise uses the text given to the store.
+    """
+    def __init__(self, entries=(), store=None):
+        self.store = store
+        self._entries = list(entries)
+        # entries before _entries, which are in store segments not read yet
+        self._offset = 0
+        self._unread_segments = 0
+        # how many entries are in store, or will be once pending saves are
+        # written
+        self._saved = 0
+        # segments as they were when loaded, and then (count, text) of what
+        # was given to the store since, which dump() copies
+        self._loaded_segments = None
+        self._stored_texts = []
+        # dump_log() of the first _dumped_count entries
+        self._dumped = ""
+        self._dumped_count = 0
+
+    @classmethod
+    def load(cls, store):
+        """
+        A log of what's in store, with only its newest segment read.
+        """
+        log = cls(store=store)
+        log._offset = log._saved = store.count
+        log._unread_segments = len(store.segments)
+        log._loaded_segments = [tuple(segment) for segment in store.segments]
+        log._read_older()
+        return log
+
+    def _read_older(self):
+        if not self._unread_segments:
+            return False
+        self._unread_segments -= 1
+        entries = self.store.read(self._unread_segments)
+        self._entries[0:0] = entries
+        self._offset -= len(entries)
+        return True
+
+    def __len__(self):
+        return self._offset + len(self._entries)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in xrange(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("log index out of range")
+        while index < self._offset:
+            self._read_older()
+        return self._entries[index - self._offset]
+
+    def __iter__(self):
+        while self._read_older():
+            pass
+        return iter(self._entries)
+
+    def __reversed__(self):
+        index = len(self) - 1
+        while index >= 0:
+            yield self[index]
+            index -= 1
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def append(self, entry):
+        self._entries.append(entry)
+
+    def extend(self, entries):
+        self._entries.extend(entries)
+
+    def save(self, store):
+        """
+        Make store hold exactly this log, appending only what it doesn't
+        have yet if it's the store this log was saved to or loaded from.
+        """
+        self.pending_save(store)()
+
+    def pending_save(self, store):
+        """
+        Like save(), but only take what's to be written now, and return a
+        function that writes it. That function can be called from another
+        thread; calls for the same store must be made in order.
+        """
+        if store is self.store:
+            batches = store.encode(self[self._saved:])
+
+            def write():
+                store.write(batches)
+        else:
+            batches = store.encode(list(self))
+
+            def write():
+                store.clear()
+                store.write(batches)
+            self.store = store
+            self._unread_segments = 0
+            self._loaded_segments = None
+            self._stored_texts = []
+            self._dumped = ""
+            self._dumped_count = 0
+
+        texts = [(count, data.decode("utf-8"))
+                for month, count, data in batches]
+        if not self._dumped_count:
+            self._stored_texts.extend(texts)
+        elif self._dumped_count == self._saved:
+            self._dumped += "".join(text for count, text in texts)
+            self._dumped_count = len(self)
+        self._saved = len(self)
+        return write
+
+    def forget_store(self):
+        """
+        For when writing what pending_save() took failed: read everything
+        from the store while it can still be trusted, and let go of it, so
+        that the next save rewrites it all.
+        """
+        while self._read_older():
+            pass
+        self.store = None
+        self._saved = 0
+        self._loaded_segments = None
+        self._stored_texts = []
+        self._dumped = ""
+        self._dumped_count = 0
+
+    def dump(self):
+        """
+        The whole log as file_storage.dump_log would write it in the compact
+        format. What's in the store is copied as is, rather than being read
+        and written again.
+        """
+        if not self._dumped_count:
+            parts = []
+            for name, count, size in self._loaded_segments or ():
+                parts.append(self.store._read_text(name, size))
+                self._dumped_count += count
+            for count, text in self._stored_texts:
+                parts.append(text)
+                self._dumped_count += count
+            self._dumped = "".join(parts)
+            self._loaded_segments = None
+            self._stored_texts = []
+        if self._dumped_count < len(self):
+            self._dumped += file_storage.dump_log(self[self._dumped_count:],
+                    compact=True)
+            self._dumped_count = len(self)
+        return self._dumped
@@ -55,7 +55,16 @@ def stop(ui):
 
 @command()
 def save(ui):
-    ui.save()
+    ui.save().addErrback(log_save_error)
+
+
+def log_save_error(failure):
+    logger.error("Error saving:\n%s", failure.getTraceback())
+
+
+@command()
+def restore(text, ui):
+    ui.restore(text.strip())
 
 
 @command()
@@ -80,6 +89,7 @@ class RemoteInterface(SavingInterface):
 
         self.best_genome = None
         self.best_fitness = None
+        self._committed_version = None
 
         if self.save_dir is not None:
             self.population_file = os.path.join(self.save_dir, "population")
@@ -160,15 +170,22 @@ class RemoteInterface(SavingInterface):
         return realresult
 
     def optimize_and_commit(self):
+        best_genome = json.dumps(self.best_genome)
+        best_fitness = json.dumps(self.best_fitness)
+        version = (self.root, self.root.changes.count,
+                best_genome, best_fitness)
+        if version == self._committed_version:
+            return
+        self._committed_version = version
+
         dumped = self.serialize()
-        # TODO: detect changes to tree internally, skip this if not dirty
         # TODO: skip optimize if hash is equal
 
         self._save_and_optimize(dumped)
 
         # these force a sync commit any time the genome changes
-        dumped["best_genome"] = json.dumps(self.best_genome)
-        dumped["best_fitness"] = json.dumps(self.best_fitness)
+        dumped["best_genome"] = best_genome
+        dumped["best_fitness"] = best_fitness
         self.sync_commit(dumped)
 
     def _save_and_optimize(self, dumped):
@@ -558,7 +575,7 @@ def main(restarter, args):
     try:
         reactor.run()
     finally:
-        ui.save()
+        ui.save_now()
 
 
 def _main():
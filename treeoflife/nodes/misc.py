@@ -3,6 +3,7 @@ from __future__ import unicode_literals, print_function
 import datetime
 
 from treeoflife.nodes.node import Node, nodecreator
+from treeoflife.exceptions import LoadError
 from treeoflife.nodes.tasks import BaseTask, ActiveMarker
 from treeoflife.ordereddict import OrderedDict
 from treeoflife.file_storage import parse_line
@@ -24,6 +25,7 @@ class GenericNode(Node):
 
     def setoption(self, option, value):
         self.metadata[option] = value
+        self._changed()
 
     def option_values(self, adapter=None):
         result = [(x, y, True) for x, y in self.metadata.items()]
@@ -50,14 +52,86 @@ class GenericActivate(Node):
         pass
 
 
+def _fully_archived(tokens):
+    """
+    Whether tokens (a subtree, indented relative to its top) are all
+    archived nodes already marked with @_af, well formed.
+    """
+    depth = -1
+    options_allowed = False
+    flagged = True
+    for indent, is_metadata, nodeid, node_type, text in tokens:
+        if is_metadata or node_type == "-":
+            if not options_allowed or indent != depth + 1:
+                return False
+            if is_metadata and node_type == "_af":
+                flagged = True
+            continue
+        if (not flagged or node_type != "archived" or nodeid is None
+                or indent > depth + 1):
+            return False
+        depth = indent
+        options_allowed = True
+        flagged = False
+    return flagged
+
+
 @nodecreator("archived")
 class Archived(GenericNode):
+    lazy_children = True
+
     def __init__(self, node_type, text, *a, **kw):
         if kw.get("nodeid", None) is None and text:
             _, _, nodeid, _, _ = parse_line(text)
             kw["nodeid"] = nodeid
         GenericNode.__init__(self, node_type, text, *a, **kw)
 
+    @property
+    def children(self):
+        if self.unloaded is not None:
+            self.load_children()
+        return self._children
+
+    @children.setter
+    def children(self, children):
+        self._children = children
+
+    def defer_children(self, tokens):
+        # only archived days, and only once everything in them has been
+        # archived, so that there's nothing for load_finished() to do
+        # when they're built later
+        if (self.parent.node_type != "days" or "_af" not in self.metadata
+                or not _fully_archived(tokens)):
+            return False
+
+        ids = self.root.ids
+        for token in tokens:
+            nodeid = token[2]
+            if nodeid is None:
+                continue
+            if nodeid in ids or nodeid in ids.unloaded:
+                raise LoadError("Duplicate node IDs #%s" % nodeid)
+            ids.unloaded[nodeid] = self
+        self.unloaded = tokens
+        return True
+
+    def load_children(self):
+        from treeoflife.tracker import load_tokens
+
+        tokens = self.unloaded
+        self.unloaded = None
+        root = self.root
+        for token in tokens:
+            root.ids.unloaded.pop(token[2], None)
+
+        # building them isn't a change to the tree
+        loading = root.loading_in_progress
+        root.loading_in_progress = True
+        try:
+            load_tokens(self, tokens, root.nodecreator)
+        finally:
+            root.loading_in_progress = loading
+
     @classmethod
     def fromnode(cls, node, parent):
         if node.node_type == "archived":
@@ -76,6 +150,8 @@ class Archived(GenericNode):
         return newnode
 
     def load_finished(self):
+        if self.unloaded is not None:
+            return
         if ("__af" in self.metadata or
                 ("__af", None, True) in self.parent.option_values()):
             self.metadata["__af"] = None
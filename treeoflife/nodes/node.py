@@ -12,10 +12,49 @@ from treeoflife.exceptions import (ListIntegrityError, LoadError,
         CantStartNodeError)
 from treeoflife.util import HandlerDict
 from treeoflife import file_storage
+from treeoflife import logstore
 
 logger = logging.getLogger(__name__)
 
 
+class _NodeIds(weakref.WeakValueDictionary):
+    """
+    Id to node mapping of a tree. Also knows the ids inside subtrees that
+    haven't been built yet (see Node.unloaded), and builds the subtree when
+    one of them is looked up.
+    """
+    def __init__(self):
+        weakref.WeakValueDictionary.__init__(self)
+        self.unloaded = {}
+
+    def _load(self, nodeid):
+        node = self.unloaded.get(nodeid)
+        if node is None:
+            return False
+        node.load_children()
+        return True
+
+    def __getitem__(self, nodeid):
+        try:
+            return weakref.WeakValueDictionary.__getitem__(self, nodeid)
+        except KeyError:
+            if not self._load(nodeid):
+                raise
+        return weakref.WeakValueDictionary.__getitem__(self, nodeid)
+
+    def __contains__(self, nodeid):
+        if weakref.WeakValueDictionary.__contains__(self, nodeid):
+            return True
+        return (self._load(nodeid) and
+                weakref.WeakValueDictionary.__contains__(self, nodeid))
+
+    def get(self, nodeid, default=None):
+        try:
+            return self[nodeid]
+        except KeyError:
+            return default
+
+
 class _NodeCreatorTracker(HandlerDict):
     name = "creators"
     autodetect = False
@@ -149,6 +188,39 @@ class _NodeListRoot(object):
         return self.length
 
 
+class TreeChanges(object):
+    """
+    What has happened to a tree since it was last written out, so that a
+    save can write only that. Nodes are recorded as touched (own text or
+    options may differ), added (whole subtree is new or moved) or removed.
+    """
+    def __init__(self):
+        self.count = 0
+        self.clear()
+
+    def clear(self):
+        self.touched = set()
+        self.added = set()
+        self.removed = set()
+        self.needs_checkpoint = False
+
+    def touch(self, node):
+        self.touched.add(node)
+        self.count += 1
+
+    def add(self, node):
+        self.added.add(node)
+        self.count += 1
+
+    def remove(self, node):
+        # empty lines have no id in the life file, so a journal can't
+        # refer to one that was already there
+        if node.node_type == "" and node not in self.added:
+            self.needs_checkpoint = True
+        self.removed.add(node)
+        self.count += 1
+
+
 class Node(object):
     multiline = False
     textless = False
@@ -159,6 +231,18 @@ class Node(object):
     children_of = None
     allowed_children = None
     preferred_parent = None
+    # whether the tracker may offer this node's subtree to
+    # defer_children() when loading
+    lazy_children = False
+    # tokens of the subtree, if it was deferred and hasn't been built yet
+    unloaded = None
+    # attributes that don't show up in serialization; any other public
+    # attribute being set marks the node as changed
+    untracked_attributes = frozenset(["root", "parent", "id", "children",
+        "referred_to", "unloaded"])
+    # (depth, date, text) of this node's subtree as serialize_to_str last
+    # wrote it; None means it or something under it has changed since
+    _serialized = None
 
     #-------------------------------------------------#
     #                 initialization                  #
@@ -188,6 +272,29 @@ class Node(object):
         if not self.multiline and text is not None and "\n" in text:
             raise LoadError("%r node cannot have newlines in text" % self)
 
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        if name[0] != "_" and name not in self.untracked_attributes:
+            self._changed()
+
+    def _changed(self):
+        """
+        Note that this node's own lines (text or options) may serialize
+        differently now.
+        """
+        self._dirty()
+        root = self.__dict__.get("_root")
+        if root is not None and not root.loading_in_progress:
+            root.changes.touch(self)
+
+    def _dirty(self):
+        # if a node isn't cached, neither are its parents, so this stops as
+        # soon as it reaches one that was already dirty
+        node = self
+        while node is not None and node._serialized is not None:
+            node._serialized = None
+            node = node.parent
+
     @property
     def parent(self):
         return self._parent
@@ -233,6 +340,15 @@ class Node(object):
         self._next_node = None
         self._prev_node = None
 
+    def defer_children(self, tokens):
+        """
+        Called while loading with the tokens of this node's subtree, if
+        lazy_children is set. Returning True means the node keeps them and
+        builds its children itself when they're needed; the tracker then
+        skips them.
+        """
+        return False
+
     def continue_text(self, text):
         if not self.multiline:
             raise LoadError("%r node cannot have newline in text" % self)
@@ -254,7 +370,11 @@ class Node(object):
         except KeyError:
             raise LoadError("node %r has no such option %r" % (self, option))
 
-        handler.set(self, value)
+        raw = getattr(value, "raw", None)
+        if raw is not None:
+            handler.restore(self, raw)
+        else:
+            handler.set(self, value)
 
     def _option_dict(self):
         try:
@@ -375,11 +495,16 @@ class Node(object):
             raise LoadError("node %r cannot be after node %r as child of %r" %
                     (child, after, self))
         self.children.insert(child, before, after)
+        self._dirty()
 
         if child.parent is None:
             child.parent = self
             child._validate()
 
+        root = self.root
+        if root is not None and not root.loading_in_progress:
+            root.changes.add(child)
+
         ihook = getattr(child, "_insertion_hook", None)
         if ihook is not None:
             ihook()
@@ -394,6 +519,11 @@ class Node(object):
     def removechild(self, child):
         self.children.remove(child)
         child.parent = None
+        self._dirty()
+
+        root = self.root
+        if root is not None and not root.loading_in_progress:
+            root.changes.remove(child)
 
     def detach(self):
         if self.parent:
@@ -641,6 +771,12 @@ class Option(object):
 
         return show, value
 
+    def snapshot(self, node):
+        return file_storage.encode_value(getattr(node, self.name))
+
+    def restore(self, node, raw):
+        setattr(node, self.name, file_storage.decode_value(raw))
+
 
 class BooleanOption(object):
     def __init__(self, name=None):
@@ -674,9 +810,14 @@ class TreeRootNode(Node):
     and where eventtype is a string, and time is a datetime object.
     """
     can_activate = True
+    untracked_attributes = Node.untracked_attributes | frozenset([
+        "ids", "nodecreator", "tracker", "loading_in_progress", "changes",
+        "editor_callback", "log", "days", "todo", "todo_review",
+        "active_node"])
 
     def __init__(self, tracker, nodecreator, loading_in_progress=False):
-        self.ids = weakref.WeakValueDictionary()
+        self.changes = TreeChanges()
+        self.ids = _NodeIds()
         self.nodecreator = nodecreator
         self.tracker = tracker
         self.loading_in_progress = loading_in_progress
@@ -686,7 +827,7 @@ class TreeRootNode(Node):
 
         self.editor_callback = None
 
-        self.log = []
+        self.log = logstore.EventLog()
 
         self.days = None
         self.active_node = self
@@ -720,6 +861,8 @@ class TreeRootNode(Node):
                 logger.warn("Attempted to activate node: %r", node)
                 return
 
+        self.active_node._changed()
+        node._changed()
         self.active_node = node
         self.log_event(self.active_node, "activation")
         for parent_node in list(node.iter_parents())[::-1]:
@@ -5,6 +5,7 @@ import datetime
 from treeoflife.parseutil import Grammar
 from treeoflife.nodes.node import Node, Option, BooleanOption, nodecreator
 from treeoflife import timefmt
+from treeoflife import file_storage
 
 
 class ActiveMarker(BooleanOption):
@@ -59,6 +60,17 @@ class FinishedOption(object):
             node.finished = started + delta
             node.started = started
 
+    def snapshot(self, node):
+        started = getattr(node, "started", None)
+        return (file_storage.encode_value(started),
+                file_storage.encode_value(node.finished))
+
+    def restore(self, node, raw):
+        started, finished = raw
+        node.finished = file_storage.decode_value(finished)
+        if started is not None:
+            node.started = file_storage.decode_value(started)
+
     def get(self, node):
         started = getattr(node, "started", None)
         finished = getattr(node, "finished", None)
@@ -1,6 +1,9 @@
 from __future__ import unicode_literals, print_function
 
+import pytest
+
 from treeoflife.tracker import Tracker
+from treeoflife.exceptions import LoadError
 
 
 def test_archival():
@@ -40,3 +43,77 @@ def test_archival():
         "        task#qwert: \xfcderk\n"
         "    task#hjklo: \xfcherp\n"
     )
+
+
+lazy_life = (
+    "days#00001\n"
+    "    archived#aaaaa: day#aaaaa: January 01, 2010\n"
+    "        @_af\n"
+    "        archived#bbbbb: task#bbbbb: \xfcderp\n"
+    "            @_af\n"
+    "            archived#ccccc: comment#ccccc: \xfcderk\n"
+    "                @_af\n"
+    "    archived#ddddd: day#ddddd: January 02, 2010\n"
+    "        @_af\n"
+    "        archived#eeeee: task#eeeee: \xfcherp\n"
+)
+
+
+def lazy_tracker(life):
+    tracker = Tracker(False)
+    tracker.lazy_load = True
+    tracker.deserialize({"life": life})
+    return tracker
+
+
+def test_lazy_archival():
+    tracker = lazy_tracker(lazy_life)
+    first, second = tracker.root.find("days > *").list()
+
+    assert first.unloaded is not None
+    assert sorted(tracker.root.ids.unloaded) == ["bbbbb", "ccccc"]
+    # not everything in it was archived yet, so it was loaded normally
+    assert second.unloaded is None
+
+    assert tracker.serialize()["life"] == lazy_life.replace(
+        "        archived#eeeee: task#eeeee: \xfcherp\n",
+        "        archived#eeeee: task#eeeee: \xfcherp\n"
+        "            @_af\n")
+    assert first.unloaded is not None
+
+
+def test_lazy_archival_ids():
+    tracker = lazy_tracker(lazy_life)
+    first = tracker.root.find("days > *").first()
+
+    assert "ccccc" in tracker.root.ids
+    assert first.unloaded is None
+    assert not tracker.root.ids.unloaded
+    assert tracker.root.ids["bbbbb"].parent is first
+    assert tracker.root.ids["ccccc"].text == "comment#ccccc: \xfcderk"
+    assert not tracker.root.changes.count
+
+
+def test_lazy_archival_children():
+    tracker = lazy_tracker(lazy_life)
+    first = tracker.root.find("days > *").first()
+
+    assert [child.id for child in first.children] == ["bbbbb"]
+    assert first.unloaded is None
+    assert tracker.serialize()["life"].startswith(
+        lazy_life[:lazy_life.index("    archived#ddddd")])
+
+
+def test_lazy_archival_empty_line():
+    # the empty line would end up inside the subtree, so it's loaded
+    # normally
+    tracker = lazy_tracker(lazy_life.replace(
+        "    archived#ddddd", "\n    archived#ddddd"))
+    first = tracker.root.find("days > *").first()
+    assert first.unloaded is None
+    assert not tracker.root.ids.unloaded
+
+
+def test_lazy_archival_duplicate_id():
+    with pytest.raises(LoadError):
+        lazy_tracker(lazy_life + "    task#bbbbb: dupe\n")
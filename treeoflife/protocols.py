@@ -147,7 +147,7 @@ class UIProtocol(JSONProtocol):
                 "pool": pool,
                 "event_queue": [event.id for event in upcoming_events],
             })
-            self.tracker.auto_save()
+            self.tracker.auto_save().addErrback(self._auto_save_failed)
         except Exception:
             logger.exception("Error updating")
             try:
@@ -158,6 +158,9 @@ class UIProtocol(JSONProtocol):
                 logger.exception("Error sending update notification")
                 self.error("exception")
 
+    def _auto_save_failed(self, failure):
+        logger.error("Error auto saving:\n%s", failure.getTraceback())
+
     def update_last_synced(self):
         if not self.tracker.syncdata:
             return
@@ -0,0 +1,79 @@
+from __future__ import unicode_literals, print_function
+
+import datetime
+
+from treeoflife.autosave import AutosaveStore
+
+
+def when(day, hour=12, minute=0):
+    return datetime.datetime(2014, 6, day, hour, minute)
+
+
+def objects(store_dir):
+    return [path for path in store_dir.join("objects").visit()
+            if path.check(file=True)]
+
+
+def test_unchanged_files_are_shared(tmpdir):
+    save = tmpdir.join("save")
+    save.join("life").write("task: first\n", ensure=True)
+    save.join("logs", "2014-06").write("entry\n", ensure=True)
+    store = AutosaveStore(str(tmpdir.join("autosave")))
+
+    first = store.add(str(save), ["life", "logs", "_journal"], when(1))
+    save.join("life").write("task: second\n")
+    second = store.add(str(save), ["life", "logs", "_journal"], when(2))
+
+    assert store.manifests() == [first, second] == [
+            "2014-06-01T12.00.00", "2014-06-02T12.00.00"]
+    assert len(objects(tmpdir.join("autosave"))) == 3
+    assert sorted(store.read_manifest(second)) == ["life", "logs/2014-06"]
+    assert (store.read_manifest(first)["logs/2014-06"]
+            == store.read_manifest(second)["logs/2014-06"])
+
+
+def test_restore(tmpdir):
+    save = tmpdir.join("save")
+    save.join("life").write("task: first\n", ensure=True)
+    save.join("logs", "2014-06").write("entry\n", ensure=True)
+    store = AutosaveStore(str(tmpdir.join("autosave")))
+    store.add(str(save), ["life", "logs"], when(1))
+
+    save.join("life").write("task: second\n")
+    save.join("logs", "2014-07").write("later\n")
+    store.add(str(save), ["life", "logs"], when(2))
+
+    assert store.find() == "2014-06-02T12.00.00"
+    assert store.find("2014-06-01") == "2014-06-01T12.00.00"
+    assert store.find("2015") is None
+
+    store.restore(store.find("2014-06-01"), str(save))
+    assert save.join("life").read() == "task: first\n"
+    assert save.join("logs", "2014-06").read() == "entry\n"
+    assert not save.join("logs", "2014-07").check()
+
+
+def test_thin(tmpdir):
+    save = tmpdir.join("save")
+    store = AutosaveStore(str(tmpdir.join("autosave")))
+    times = [when(1, 9), when(1, 18), when(2, 9), when(3, 10, 5),
+            when(3, 10, 40), when(3, 11, 10), when(3, 11, 50),
+            when(3, 12, 0)]
+    for index, time in enumerate(times):
+        save.join("life").write("version %d\n" % index, ensure=True)
+        store.add(str(save), ["life"], time)
+
+    store.thin(when(3, 12, 20))
+    assert store.manifests() == [
+            # daily
+            "2014-06-01T18.00.00",
+            "2014-06-02T09.00.00",
+            # hourly
+            "2014-06-03T10.40.00",
+            "2014-06-03T11.10.00",
+            # all
+            "2014-06-03T11.50.00",
+            "2014-06-03T12.00.00"]
+    assert len(objects(tmpdir.join("autosave"))) == 6
+    for name in store.manifests():
+        store.restore(name, str(tmpdir.join("restored")))
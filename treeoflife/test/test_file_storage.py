@@ -1,11 +1,16 @@
 from __future__ import unicode_literals, print_function
 
 import datetime
+import io
 
 import pytest
 
-from treeoflife.file_storage import parse_line, dump_log, load_log
-from treeoflife.tracker import LoadError
+from treeoflife.file_storage import (parse_line, dump_log, load_log,
+        _parse_line_slow, FileParser, parse_string, encode_value,
+        decode_value, snapshot_records, serialize_to_str, dump_snapshot,
+        load_snapshot, serialize)
+from treeoflife.tracker import LoadError, Tracker
+from treeoflife import file_storage
 
 
 class TestParseLine(object):
@@ -126,6 +131,109 @@ class TestParseLine(object):
             parse_line(b"herp: derp")
 
 
+@pytest.mark.parametrize("line", [
+    u"",
+    u"    ",
+    u"\xfccategory: \xfcpersonal",
+    u"        task#abcde: with: colons # and #hashes",
+    u"    task#abcde",
+    u"    task#abcde:",
+    u"    task: ",
+    u"    task:  leading space",
+    u"    @option",
+    u"    @option: value",
+    u"    @-option: value",
+    u"    @ option",
+    u"    @",
+    u"    -",
+    u"    - ",
+    u"    - continued: text",
+    u": no type",
+    u"#abcde: no type",
+    u"task\n",
+    u"    \n",
+    u"  task",
+    u"   -x",
+    u"    -x",
+    u"task:text",
+    u"task#abcd: short",
+    u"task#abcdef: long",
+    u"task#abcdef",
+    u"task#abc-e: bad",
+    u"task#abcde#: bad",
+    u"task#: empty",
+    u"@option#abcde: value",
+])
+def test_parse_line_matches_state_machine(line):
+    try:
+        expected = _parse_line_slow(line)
+    except LoadError as e:
+        with pytest.raises(LoadError) as excinfo:
+            parse_line(line)
+        assert str(excinfo.value) == str(e)
+    else:
+        result = parse_line(line)
+        assert result == expected
+        assert [type(x) for x in result] == [type(x) for x in expected]
+
+
+class TestFileParser(object):
+    data = (
+        u"\xfccategory#abcde: \xfcpersonal\n"
+        u"    @option: value\n"
+        u"\n"
+        u"    task: \xfcthing\n"
+    )
+    expected = [
+        (0, False, u"abcde", u"\xfccategory", u"\xfcpersonal"),
+        (1, True, None, u"option", u"value"),
+        (0, False, None, u"", None),
+        (1, False, None, u"task", u"\xfcthing"),
+    ]
+
+    def test_string(self):
+        assert list(parse_string(self.data)) == self.expected
+
+    def test_file(self):
+        reader = io.BytesIO(self.data.encode("utf-8"))
+        assert list(FileParser(reader)) == self.expected
+
+    def test_streams(self):
+        consumed = []
+
+        def reader():
+            for line in io.BytesIO(self.data.encode("utf-8")):
+                consumed.append(line)
+                yield line
+
+        parser = iter(FileParser(reader()))
+        next(parser)
+        assert len(consumed) == 2
+
+    def test_error_line(self):
+        parser = FileParser(io.BytesIO(b"a\nb\n  c\nd\n"))
+        with pytest.raises(LoadError):
+            list(parser)
+        assert parser.error_context.line == 2
+
+    def test_parallel(self):
+        parser = file_storage.ParallelParser(self.data, processes=2)
+        assert list(parser) == self.expected
+
+    def test_parallel_matches(self):
+        from treeoflife.benchmarks import generate_life
+        data = generate_life(3000)
+        assert (list(file_storage.ParallelParser(data, processes=3))
+                == list(parse_string(data)))
+
+    def test_parallel_error_line(self):
+        parser = file_storage.ParallelParser(
+                "a\n" * 20 + "  c\nd\n", processes=2)
+        with pytest.raises(LoadError):
+            list(parser)
+        assert parser.error_context.line == 20
+
+
 def test_dump_log():
     # create the log
     log = [
@@ -237,3 +345,193 @@ def test_load_log_plural():
             datetime.datetime(2044, 8, 1, 20, 27, 44)
         )
     ]
+
+
+codec_log = [
+    (
+        [
+            ('00000', 'life', None),
+            ('00001', 'days', None),
+            ('Nf01s', 'day', 'July 31, 2014 (Thursday, yesterday)')
+        ],
+        'activation',
+        datetime.datetime(2014, 8, 1, 20, 27, 44)
+    ),
+    (
+        [
+            ('00000', 'life', None),
+            ('00001', 'days', None),
+            ('Nf01s', 'day', 'July 31, 2014 (Thursday, yesterday)'),
+            ('abcde', 'task', '\xfcthings\tand\\stuff\nmore - "quoted"')
+        ],
+        'jump',
+        datetime.datetime(2014, 8, 1, 20, 30, 0)
+    ),
+    (
+        [
+            ('00000', 'life', None),
+            ('00001', 'days', None),
+            ('Nf01s', 'day', 'July 31, 2014 (Thursday, yesterday)'),
+            ('abcde', 'task', '\xfcthings\tand\\stuff\nmore - "quoted"')
+        ],
+        'activation',
+        datetime.datetime(14, 8, 2, 9, 5, 1)
+    ),
+    (
+        [('00000', 'life', None), ('bcdef', 'task', None)],
+        'activation',
+        datetime.datetime(2044, 8, 1, 20, 27, 44)
+    ),
+]
+
+
+def test_dump_log_compact():
+    assert dump_log(codec_log[::3], compact=True) == (
+        '2014-08-01 20:27:44\tactivation\t0\tlife#00000\tdays#00001\t'
+            'day#Nf01s: July 31, 2014 (Thursday, yesterday)\n'
+        '2044-08-01 20:27:44\tactivation\t1\ttask#bcdef\n'
+    )
+
+
+@pytest.mark.parametrize("compact", [False, True])
+def test_log_roundtrip(compact):
+    assert load_log(dump_log(codec_log, compact=compact)) == codec_log
+
+
+def test_load_log_mixed():
+    data = (dump_log(codec_log[:2]) + dump_log(codec_log[2:], compact=True)
+            + dump_log(codec_log[:1], compact=True))
+    assert load_log(data) == codec_log + codec_log[:1]
+
+
+@pytest.mark.parametrize("value", [
+    None, True, 3, "text",
+    datetime.datetime(2013, 5, 6, 7, 8, 9, 10),
+    datetime.date(2013, 5, 6),
+    datetime.time(7, 8),
+    datetime.timedelta(days=1, seconds=5),
+])
+def test_snapshot_value_roundtrip(value):
+    assert decode_value(encode_value(value)) == value
+
+
+def test_snapshot_value_unsupported():
+    with pytest.raises(TypeError):
+        encode_value(object())
+
+
+class TestSnapshot(object):
+    life = (
+        "category: personal\n"
+        "    task: something\n"
+        "        @started: June 7, 2013 12:00:00 PM\n"
+        "        @finished: June 7, 2013 1:00:00 PM\n"
+        "        - continued\n"
+        "\n"
+        "    comment: hi\n"
+        "todo bucket\n"
+        "    todo#abcde: do things\n"
+    )
+
+    def tracker(self):
+        tracker = Tracker(skeleton=False)
+        tracker.deserialize({"life": self.life})
+        return tracker
+
+    def test_records_match_text(self):
+        root = self.tracker().root
+        records = snapshot_records(root)
+        text = serialize_to_str(root)
+        assert [record[:5] for record in records] == list(parse_string(text))
+        raws = [record[5] for record in records if record[5] is not None]
+        assert raws == [(
+            ("datetime", 2013, 6, 7, 12, 0, 0, 0),
+            ("datetime", 2013, 6, 7, 13, 0, 0, 0),
+        )]
+
+    def test_roundtrip(self):
+        root = self.tracker().root
+        data = serialize_to_str(root).encode("utf-8")
+        parser = load_snapshot(dump_snapshot(root, data), data)
+
+        restored = Tracker(skeleton=False)
+        restored.deserialize({"life": parser})
+        assert serialize_to_str(restored.root) == serialize_to_str(root)
+
+    def test_rejects_mismatch(self):
+        root = self.tracker().root
+        data = serialize_to_str(root).encode("utf-8")
+        snapshot = dump_snapshot(root, data)
+        assert load_snapshot(snapshot, data + b"x") is None
+        assert load_snapshot(b"garbage" + snapshot, data) is None
+        assert load_snapshot(snapshot[:-5], data) is None
+
+
+class TestSerializeCache(object):
+    life = TestSnapshot.life
+
+    def tracker(self):
+        tracker = Tracker(skeleton=False)
+        tracker.deserialize({"life": self.life})
+        return tracker
+
+    def uncached(self, root):
+        return "\n".join(serialize(root, is_root=True)) + "\n"
+
+    def test_unchanged(self):
+        root = self.tracker().root
+        text = serialize_to_str(root)
+        assert text == self.uncached(root)
+        assert serialize_to_str(root) is text
+
+    def test_changed_path_only(self):
+        root = self.tracker().root
+        serialize_to_str(root)
+        task = root.find("category > task").one()
+        todo_bucket = root.find("todo bucket").one()
+        todo_block = todo_bucket._serialized
+
+        task.text = "something else"
+        assert task._serialized is None
+        assert task.parent._serialized is None
+        assert root._serialized is None
+        assert todo_bucket._serialized is todo_block
+
+        text = serialize_to_str(root)
+        assert text == self.uncached(root)
+        assert "something else" in text
+        assert todo_bucket._serialized is todo_block
+
+    def test_options_and_moves(self):
+        root = self.tracker().root
+        serialize_to_str(root)
+
+        task = root.find("category > task").one()
+        task.finished = None
+        assert serialize_to_str(root) == self.uncached(root)
+
+        task.detach()
+        root.addchild(task)
+        root.activate(task)
+        text = serialize_to_str(root)
+        assert text == self.uncached(root)
+        assert "\ntask#" in text
+        assert "\n    @active" in text
+
+    def test_expires_daily(self, monkeypatch):
+        root = self.tracker().root
+        text = serialize_to_str(root)
+        today = datetime.date.today()
+
+        class date(object):
+            @staticmethod
+            def today():
+                return today + datetime.timedelta(days=1)
+
+        class fake_datetime(object):
+            pass
+        fake_datetime.date = date
+
+        monkeypatch.setattr(file_storage, "datetime", fake_datetime)
+        assert serialize_to_str(root) == text
+        assert root._serialized[1] == today + datetime.timedelta(days=1)
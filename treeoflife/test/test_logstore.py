@@ -0,0 +1,142 @@
+from __future__ import unicode_literals, print_function
+
+import datetime
+
+from treeoflife.logstore import LogStore, EventLog
+from treeoflife.file_storage import dump_log, load_log
+from treeoflife.tracker import Tracker
+
+
+def entry(month, day, nodeid="abcde"):
+    return ([("00000", "life", None), (nodeid, "task", "\xfcthing")],
+            "activation", datetime.datetime(2014, month, day, 12, 30))
+
+
+entries = [entry(5, 30), entry(5, 31, "bcdef"), entry(6, 1), entry(6, 2),
+        entry(7, 1, "cdefg")]
+
+
+def test_segments(tmpdir):
+    store = LogStore(str(tmpdir))
+    store.append(entries[:3])
+    store.append(entries[3:])
+
+    assert [name for name, count, size in store.segments] == [
+            "2014-05", "2014-06", "2014-07"]
+    assert store.count == 5
+    assert tmpdir.join("2014-06").read_binary().decode("utf-8") == (
+            dump_log(entries[2:3], compact=True)
+            + dump_log(entries[3:4], compact=True))
+
+    reloaded = LogStore(str(tmpdir))
+    assert reloaded.segments == store.segments
+    assert reloaded.read(1) == entries[2:4]
+
+
+def test_unfinished_append(tmpdir):
+    store = LogStore(str(tmpdir))
+    store.append(entries[:2])
+    tmpdir.join("2014-05").write(b"2014-05-31 12:", mode="ab")
+
+    store = LogStore(str(tmpdir))
+    assert store.read(0) == entries[:2]
+    store.append([entry(5, 31, "defgh")])
+    assert store.read(0) == entries[:2] + [entry(5, 31, "defgh")]
+
+
+def test_event_log_reads_lazily(tmpdir):
+    store = LogStore(str(tmpdir))
+    store.append(entries)
+
+    log = EventLog.load(store)
+    assert len(log) == 5
+    assert log._unread_segments == 2
+    assert log[-1] == entries[-1]
+
+    recent = reversed(log)
+    assert next(recent) == entries[4]
+    assert next(recent) == entries[3]
+    assert log._unread_segments == 1
+
+    assert log[0] == entries[0]
+    assert log._unread_segments == 0
+    assert list(log) == entries
+
+
+def test_event_log_save_and_dump(tmpdir):
+    store = LogStore(str(tmpdir))
+    store.append(entries[:3])
+
+    log = EventLog.load(store)
+    log.append(entries[3])
+    log.save(store)
+    assert LogStore(str(tmpdir)).count == 4
+    log.append(entries[4])
+    assert load_log(log.dump()) == entries
+
+    other = LogStore(str(tmpdir.join("other")))
+    other.append(entries[:1])
+    log.save(other)
+    assert EventLog.load(LogStore(other.path)) == entries
+
+
+def test_tracker_save_and_load(tmpdir):
+    tracker = Tracker(skeleton=False)
+    tracker.deserialize({"life": "task#abcde: thing\n",
+        "log": dump_log(entries)})
+    tmpdir.join("log").write("old log")
+
+    tracker.save(str(tmpdir))
+    assert not tmpdir.join("log").check()
+    assert LogStore(str(tmpdir.join("logs"))).count == 5
+
+    tracker.root.log.append(entry(7, 2))
+    tracker.save(str(tmpdir))
+    assert tmpdir.join("logs", "2014-07").read_binary().decode(
+            "utf-8") == (dump_log(entries[4:], compact=True)
+                + dump_log([entry(7, 2)], compact=True))
+
+    loaded = Tracker(skeleton=False)
+    loaded.load(str(tmpdir))
+    assert loaded.root.log._unread_segments == 2
+    assert loaded.root.log == entries + [entry(7, 2)]
+    assert loaded.serialize()["log"] == tracker.serialize()["log"]
+
+
+def test_tracker_loads_old_log_file(tmpdir):
+    tmpdir.join("life").write("task#abcde: thing\n")
+    tmpdir.join("log").write(dump_log(entries))
+
+    tracker = Tracker(skeleton=False)
+    tracker.load(str(tmpdir))
+    assert tracker.root.log == entries
+
+
+def test_forget_store(tmpdir):
+    store = LogStore(str(tmpdir))
+    EventLog(entries[:4]).save(store)
+
+    log = EventLog.load(LogStore(str(tmpdir)))
+    log.append(entries[4])
+    log.pending_save(log.store)
+    # as if that write failed
+    log.forget_store()
+    assert log.store is None
+
+    store = LogStore(str(tmpdir))
+    log.save(store)
+    assert EventLog.load(LogStore(str(tmpdir))) == entries
+
+
+def test_dump_before_pending_write(tmpdir):
+    EventLog(entries[:3]).save(LogStore(str(tmpdir)))
+    log = EventLog.load(LogStore(str(tmpdir)))
+    log.extend(entries[3:])
+    write = log.pending_save(log.store)
+
+    # the store doesn't have the new entries yet, but dump() matches what
+    # it will have
+    dumped = log.dump()
+    write()
+    assert dumped == "".join(log.store.read_text(index)
+            for index in range(len(log.store.segments)))
@@ -8,6 +8,7 @@ from treeoflife.nodes.misc import GenericNode, GenericActivate
 from treeoflife.nodes.node import TreeRootNode
 from treeoflife.test.util import FakeNodeCreator, match
 from treeoflife import exceptions
+from treeoflife import file_storage
 
 from treeoflife.tracker import Tracker
 
@@ -177,3 +178,164 @@ class TestTracker(object):
         tracker.deserialize({"life": ""})
 
         assert type(tracker.root) is SubRootNode
+
+
+def test_parallel_parse(tmpdir):
+    from treeoflife.benchmarks import generate_life
+    life = generate_life(2000)
+    tmpdir.join("life").write_binary(life.encode("utf-8"))
+
+    tracker = Tracker(skeleton=False)
+    tracker.parallel_parse = True
+    tracker.load(str(tmpdir))
+    assert tracker.serialize()["life"] == life
+
+
+class TestSnapshot(object):
+    life = (
+        "task: something\n"
+        "    @started: June 07, 2013 12:00:00 PM\n"
+        "    task: else\n"
+    )
+
+    def test_load_uses_snapshot(self, tmpdir, monkeypatch):
+        tracker = Tracker(skeleton=False)
+        tracker.deserialize({"life": self.life})
+        files = tracker.save(str(tmpdir))
+        tracker.save_snapshot(str(tmpdir), files["life"])
+        assert tmpdir.join("_snapshot").check()
+
+        def fail(*args):  # pragma: no cover
+            assert False, "should not parse text"
+        monkeypatch.setattr(file_storage, "FileParser", fail)
+        monkeypatch.setattr(file_storage, "parse_string", fail)
+
+        loaded = Tracker(skeleton=False)
+        loaded.load(str(tmpdir))
+        assert loaded.serialize()["life"] == files["life"]
+
+    def test_stale_snapshot(self, tmpdir):
+        tracker = Tracker(skeleton=False)
+        tracker.deserialize({"life": self.life})
+        files = tracker.save(str(tmpdir))
+        tracker.save_snapshot(str(tmpdir), files["life"])
+        tmpdir.join("life").write_binary(b"task: changed\n")
+
+        loaded = Tracker(skeleton=False)
+        loaded.load(str(tmpdir))
+        assert loaded.root.children.next_neighbor.text == "changed"
+
+
+class TestJournal(object):
+    life = (
+        "category#aaaaa: personal\n"
+        "    task#bbbbb: something\n"
+        "        @started: June 07, 2013 12:00:00 PM\n"
+        "        task#ccccc: else\n"
+        "    task#ddddd: other\n"
+    )
+
+    def saved(self, tmpdir):
+        tracker = Tracker(skeleton=False)
+        tracker.deserialize({"life": self.life})
+        tracker.save_journal(str(tmpdir))
+        return tracker
+
+    def reload(self, tmpdir):
+        loaded = Tracker(skeleton=False)
+        loaded.load(str(tmpdir))
+        return loaded.serialize()["life"]
+
+    def test_first_save_checkpoints(self, tmpdir):
+        tracker = self.saved(tmpdir)
+        assert tmpdir.join("life").read_text("utf-8") == self.life
+        assert not tmpdir.join("_journal").check()
+        assert tracker.root.changes.touched == set()
+
+    def test_appends(self, tmpdir):
+        tracker = self.saved(tmpdir)
+        root = tracker.root
+        root.ids["ccccc"].text = "changed"
+        root.ids["aaaaa"].createchild("task", "new",
+                before=root.ids["ddddd"])
+        tracker.save_journal(str(tmpdir))
+
+        assert tmpdir.join("life").read_text("utf-8") == self.life
+        assert len(tmpdir.join("_journal").readlines()) == 2
+        assert self.reload(tmpdir) == tracker.serialize()["life"]
+
+    def test_nothing_changed(self, tmpdir):
+        tracker = self.saved(tmpdir)
+        tracker.save_journal(str(tmpdir))
+        assert not tmpdir.join("_journal").check()
+
+    def test_remove_and_move(self, tmpdir):
+        tracker = self.saved(tmpdir)
+        root = tracker.root
+        root.ids["ddddd"].detach()
+        tracker.save_journal(str(tmpdir))
+
+        moved = root.ids["ccccc"]
+        moved.parent.removechild(moved)
+        root.ids["aaaaa"].addchild(moved, before=root.ids["bbbbb"])
+        root.ids["bbbbb"].createchild("comment", "two\nlines")
+        tracker.save_journal(str(tmpdir))
+
+        assert len(tmpdir.join("_journal").readlines()) == 3
+        assert self.reload(tmpdir) == (
+            "category#aaaaa: personal\n"
+            "    task#ccccc: else\n"
+            "    task#bbbbb: something\n"
+            "        @started: June 07, 2013 12:00:00 PM\n"
+            "        comment#%s: two\n"
+            "            - lines\n"
+        ) % root.ids["bbbbb"].children.next_neighbor.id
+
+    def test_options_and_log(self, tmpdir):
+        tracker = self.saved(tmpdir)
+        root = tracker.root
+        root.activate(root.ids["ddddd"])
+        tracker.save_journal(str(tmpdir))
+
+        loaded = Tracker(skeleton=False)
+        loaded.load(str(tmpdir))
+        assert loaded.root.active_node.id == "ddddd"
+        assert loaded.root.log[0][:2] == root.log[0][:2]
+
+    def test_save_folds_journal(self, tmpdir):
+        tracker = self.saved(tmpdir)
+        tracker.root.ids["ccccc"].text = "changed"
+        tracker.save_journal(str(tmpdir))
+        assert tmpdir.join("_journal").check()
+
+        tracker.save(str(tmpdir))
+        assert not tmpdir.join("_journal").check()
+        assert "changed" in tmpdir.join("life").read_text("utf-8")
+
+    def test_new_root_checkpoints(self, tmpdir):
+        tracker = self.saved(tmpdir)
+        tracker.deserialize({"life": "task#eeeee: replaced\n"})
+        tracker.save_journal(str(tmpdir))
+        assert not tmpdir.join("_journal").check()
+        assert self.reload(tmpdir) == "task#eeeee: replaced\n"
+
+    def test_stale_journal_ignored(self, tmpdir):
+        tracker = self.saved(tmpdir)
+        tracker.root.ids["ccccc"].text = "changed"
+        tracker.save_journal(str(tmpdir))
+        tmpdir.join("life").write_text(self.life + "task#eeeee: hi\n",
+                "utf-8")
+        assert "changed" not in self.reload(tmpdir)
+
+    def test_truncated_entry(self, tmpdir):
+        tracker = self.saved(tmpdir)
+        tracker.root.ids["ccccc"].text = "changed"
+        tracker.save_journal(str(tmpdir))
+        tracker.root.ids["ddddd"].text = "lost"
+        tracker.save_journal(str(tmpdir))
+
+        journal = tmpdir.join("_journal")
+        journal.write_binary(journal.read_binary()[:-10])
+        result = self.reload(tmpdir)
+        assert "changed" in result
+        assert "lost" not in result
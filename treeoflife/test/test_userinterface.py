@@ -1,6 +1,7 @@
 from __future__ import unicode_literals, print_function
 
 import pytest
+from twisted.internet.defer import Deferred
 from twisted.internet.task import Clock
 
 from treeoflife import userinterface
@@ -99,3 +100,144 @@ def test_command(monkeypatch):
     command.execute()
 
     assert calls == ["testhandler", "previewable"]
+
+
+class TestSaving(object):
+    class Interface(userinterface.SavingInterface):
+        def _defer_to_thread(self, f):
+            deferred = Deferred()
+            self.jobs.append((f, deferred))
+            return deferred
+
+        def run_job(self):
+            f, deferred = self.jobs.pop(0)
+            try:
+                result = f()
+            except Exception:
+                deferred.errback()
+            else:
+                deferred.callback(result)
+
+    @pytest.fixture
+    def ui(self, tmpdir):
+        ui = self.Interface(str(tmpdir.join("save")), None, False,
+                reactor=Clock())
+        ui.jobs = []
+        ui.root.createchild("task", "first")
+        return ui
+
+    def results(self, deferred):
+        results = []
+        deferred.addBoth(results.append)
+        return results
+
+    def test_save_writes_later(self, ui, tmpdir):
+        results = self.results(ui.save())
+        assert len(ui.jobs) == 1
+        assert not tmpdir.join("save").check()
+
+        ui.run_job()
+        assert results == [None]
+        assert ": first" in tmpdir.join("save", "life").read()
+        assert tmpdir.join("save", ui.snapshot_filename).check()
+
+    def test_coalesce(self, ui, tmpdir):
+        first = self.results(ui.save())
+        ui.root.createchild("task", "second")
+        second = self.results(ui.save())
+        ui.root.createchild("task", "third")
+        third = self.results(ui.auto_save())
+        assert len(ui.jobs) == 1
+
+        ui.run_job()
+        assert first == [None]
+        assert second == third == []
+        assert ": third" not in tmpdir.join("save", "life").read()
+        assert len(ui.jobs) == 1
+
+        ui.run_job()
+        assert second == third == [None]
+        assert ": third" in tmpdir.join("save", "life").read()
+        assert not ui.jobs
+
+    def test_auto_save(self, ui, tmpdir):
+        ui.save()
+        ui.run_job()
+        ui.root.createchild("task", "second")
+        ui.auto_save()
+        ui.run_job()
+        assert tmpdir.join("save", ui.journal_filename).check()
+        assert ": second" not in tmpdir.join("save", "life").read()
+
+        loaded = Tracker(skeleton=False)
+        loaded.load(str(tmpdir.join("save")))
+        assert loaded.root.find("second").one()
+
+    def test_failure(self, ui, tmpdir):
+        tmpdir.join("save").write("not a directory")
+        failed = self.results(ui.save())
+        ui.run_job()
+        assert len(failed) == 1 and failed[0].check(EnvironmentError)
+
+        # it's not known what got written, so this has to be a full save
+        tmpdir.join("save").remove()
+        assert self.results(ui.auto_save()) == []
+        ui.run_job()
+        assert not tmpdir.join("save", ui.journal_filename).check()
+        assert ": first" in tmpdir.join("save", "life").read()
+
+    def test_restore(self, ui, tmpdir):
+        ui.auto_save()
+        ui.run_job()
+        assert len(ui.autosaves.manifests()) == 1
+
+        ui.root.createchild("task", "second")
+        ui.save()
+        ui.run_job()
+        assert ui.restore() == ui.autosaves.manifests()[0]
+        assert not ui.root.find("second").first()
+        assert ui.root.find("first").one()
+        assert not tmpdir.join("save", ui.snapshot_filename).check()
+
+        with pytest.raises(exceptions.InvalidInputError):
+            ui.restore("1999")
+
+    def test_save_now(self, ui, tmpdir):
+        ui.save_now()
+        assert not ui.jobs
+        assert ": first" in tmpdir.join("save", "life").read()
+
+
+def _has_git():
+    try:
+        userinterface.Git(".")
+    except RuntimeError:
+        return False
+    return True
+
+
+@pytest.mark.skipif("not _has_git()")
+def test_fast_import_git(tmpdir):
+    git = userinterface.FastImportGit(str(tmpdir))
+    git.init()
+    tmpdir.join("life").write("task: first\n")
+    tmpdir.join("logs", "index").write("{}", ensure=True)
+    tmpdir.join("log").write("old log")
+    git.save(["life", "logs", "log"], "first")
+
+    tmpdir.join("life").write("task: second\n")
+    tmpdir.join("log").remove()
+    git.save(["life", "logs", "log"], "second")
+    git.close()
+
+    assert git._output("log", "--format=%s") == "second\nfirst"
+    assert git._output("show", "HEAD:life") == "task: second"
+    assert git._output("ls-tree", "-r", "--name-only", "HEAD") == (
+            "life\nlogs/index")
+
+    # a new process carries on from the existing history
+    git = userinterface.FastImportGit(str(tmpdir))
+    tmpdir.join("life").write("task: third\n")
+    git.save(["life", "logs", "log"], "third")
+    git.close()
+    assert git._output("log", "--format=%s") == "third\nsecond\nfirst"
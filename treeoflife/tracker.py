@@ -1,6 +1,7 @@
 from __future__ import unicode_literals, print_function
 
 import traceback
+import logging
 import json
 import os
 
@@ -9,10 +10,109 @@ from twisted.internet.defer import Deferred
 from treeoflife.exceptions import LoadError, ErrorContext
 from treeoflife.nodes.node import TreeRootNode, nodecreator
 from treeoflife import file_storage
+from treeoflife import journal
+from treeoflife import logstore
+
+logger = logging.getLogger(__name__)
+
+
+def load_tokens(parent, tokens, nodecreator, lazy=False):
+    """
+    Create nodes from life file tokens, as children of parent.
+
+    With lazy, a node whose class has lazy_children is offered the tokens
+    of its subtree (with indents relative to its children) through
+    defer_children(), and if it takes them, they are skipped here.
+    """
+    stack = []
+    lastnode = parent
+    lastindent = -1
+    metadata_allowed_here = False
+
+    # node whose subtree is being collected, its indent, and the tokens
+    # collected so far
+    deferring = None
+    # tokens to process again, in reverse order
+    pending = []
+
+    tokens = iter(tokens)
+    while True:
+        if pending:
+            token = pending.pop()
+        else:
+            token = next(tokens, None)
+
+        if deferring is not None:
+            node, node_indent, deferred = deferring
+            in_subtree = (token is not None and token[3] != ""
+                    and token[0] > node_indent)
+            if in_subtree and (deferred or not (token[1] or token[3] == "-")):
+                deferred.append(token)
+                continue
+            if not in_subtree:
+                deferring = None
+            if not in_subtree and deferred:
+                relative = [(deferred_token[0] - node_indent - 1,)
+                        + deferred_token[1:] for deferred_token in deferred]
+                # an empty line right after the subtree would belong to it
+                if ((token is None or token[3] != "")
+                        and node.defer_children(relative)):
+                    metadata_allowed_here = False
+                else:
+                    if token is not None:
+                        pending.append(token)
+                    pending.extend(reversed(deferred))
+                    continue
+
+        if token is None:
+            break
+
+        indent, is_metadata, nodeid, node_type, text = token
+        if node_type == "":
+            indent = lastindent
+            if lastnode is not None and lastnode.node_type != "":
+                indent += 1
+        if indent > lastindent:
+            if indent > lastindent + 1:
+                raise LoadError("indented too far")
+            stack.append(lastnode)
+            metadata_allowed_here = True
+        elif indent < lastindent:
+            stack = stack[:int(indent) + 1]
+        lastindent = indent
+
+        parent = stack[-1]
+
+        if is_metadata:
+            if not metadata_allowed_here:
+                raise LoadError('metadata in the wrong place')
+            parent.setoption(node_type, text)
+            lastnode = None
+        else:
+            if node_type != "-":
+                metadata_allowed_here = False
+
+            node = nodecreator.create(node_type, text, parent,
+                    nodeid=nodeid)
+            if node is not None:
+                parent.addchild(node)
+                if lazy and node.lazy_children:
+                    deferring = node, indent, []
+            lastnode = node
 
 
 class Tracker(object):
     filenames = ["log", "life"]
+    # where save() puts the log, which is only kept as the "log" file by
+    # older versions (and loaded from there if it's found)
+    log_dirname = "logs"
+    snapshot_filename = "_snapshot"
+    journal_filename = "_journal"
+    journal_checkpoint_size = 1024 * 1024
+    # leave subtrees that nodes allow to be loaded lazily unbuilt
+    lazy_load = False
+    # tokenize life files in a process pool (see file_storage.ParallelParser)
+    parallel_parse = False
 
     def __init__(self, skeleton=True, nodecreator=nodecreator,
             roottype=TreeRootNode):
@@ -20,6 +120,12 @@ class Tracker(object):
         self.nodecreator = nodecreator
         self.config = {}
 
+        # what save_journal() last saved: which tree and where; and the hash
+        # of the life file the journal builds on
+        self._journal_root = None
+        self._journal_dir = None
+        self._journal_checkpoint = None
+
         self.roottype = roottype
 
         self.root = self.roottype(self, self.nodecreator,
@@ -34,55 +140,27 @@ class Tracker(object):
         deserialize must allow for any key to be missing. If a file is not
         present in that dictionary, it should be like an empty string in that
         dictionary.
+
+        files["life"] may also be an open file, in which case it is parsed
+        as it is read, or a file_storage.SnapshotParser. files["log"] may
+        also be a logstore.EventLog.
         """
         self.root = root = self.roottype(self, self.nodecreator,
                 loading_in_progress=True)
         root.loading_in_progress = True
 
         log_data = files.get('log', u'')
-        self.root.log = file_storage.load_log(log_data)
-
-        stack = []
-        lastnode = root
-        lastindent = -1
-        metadata_allowed_here = False
+        if isinstance(log_data, logstore.EventLog):
+            self.root.log = log_data
+        else:
+            self.root.log = logstore.EventLog(file_storage.load_log(log_data))
 
         error_context = ErrorContext()  # mutable thingy
 
         try:
-            life_data = files.get('life', u'')
-            parser = file_storage.parse_string(life_data)
+            parser = self._life_parser(files.get('life', u''))
             parser.error_context = error_context
-            for indent, is_metadata, nodeid, node_type, text in parser:
-                if node_type == "":
-                    indent = lastindent
-                    if lastnode is not None and lastnode.node_type != "":
-                        indent += 1
-                if indent > lastindent:
-                    if indent > lastindent + 1:
-                        raise LoadError("indented too far")
-                    stack.append(lastnode)
-                    metadata_allowed_here = True
-                elif indent < lastindent:
-                    stack = stack[:int(indent) + 1]
-                lastindent = indent
-
-                parent = stack[-1]
-
-                if is_metadata:
-                    if not metadata_allowed_here:
-                        raise LoadError('metadata in the wrong place')
-                    parent.setoption(node_type, text)
-                    lastnode = None
-                else:
-                    if node_type != "-":
-                        metadata_allowed_here = False
-
-                    node = self.nodecreator.create(node_type, text, parent,
-                            nodeid=nodeid)
-                    if node is not None:
-                        parent.addchild(node)
-                    lastnode = node
+            load_tokens(root, parser, self.nodecreator, lazy=self.lazy_load)
         except LoadError as e:
             e.error_context = error_context
             raise
@@ -95,16 +173,30 @@ class Tracker(object):
             root.make_skeleton()
 
         root.load_finished()
-        for depth, node in root.iter_flat_children():
+        for depth, node, skip in root.iter_flat_children(skipper=True):
             node.load_finished()
+            if node.unloaded is not None:
+                skip()
 
         # enable instant load_finished() on node creation
         root.loading_in_progress = False
 
+    def _life_parser(self, life_data):
+        if isinstance(life_data, file_storage.SnapshotParser):
+            return life_data
+        elif self.parallel_parse:
+            if not isinstance(life_data, unicode):
+                life_data = life_data.read().decode("utf-8")
+            return file_storage.ParallelParser(life_data)
+        elif isinstance(life_data, unicode):
+            return file_storage.parse_string(life_data)
+        else:
+            return file_storage.FileParser(life_data)
+
     def serialize(self):
         return {
             "life": file_storage.serialize_to_str(self.root),
-            "log": file_storage.dump_log(self.root.log)
+            "log": self.root.log.dump()
         }
 
     def load(self, save_dir):
@@ -115,21 +207,199 @@ class Tracker(object):
 
         files = {}
         for filename in self.filenames:
+            if filename == "life":
+                continue
             path = os.path.join(save_dir, filename)
             if os.path.exists(path):
                 with open(path, "r") as reader:
                     files[filename] = reader.read().decode("utf-8")
 
+        # save() removes the old log file once the log store has everything
+        # in it, so if there is one, it's newer than the store
+        log_path = os.path.join(save_dir, self.log_dirname)
+        if "log" not in files and logstore.LogStore.exists(log_path):
+            files["log"] = logstore.EventLog.load(
+                    logstore.LogStore(log_path))
+
+        life_path = os.path.join(save_dir, "life")
+        if not os.path.exists(life_path):
+            self.deserialize(files)
+            return
+
+        snapshot_path = os.path.join(save_dir, self.snapshot_filename)
+        journal_path = os.path.join(save_dir, self.journal_filename)
+        if (not os.path.exists(snapshot_path)
+                and not os.path.exists(journal_path)):
+            with open(life_path, "r") as reader:
+                files["life"] = reader
+                self.deserialize(files)
+            return
+
+        with open(life_path, "r") as reader:
+            life_bytes = reader.read()
+        life = None
+        if os.path.exists(snapshot_path):
+            with open(snapshot_path, "rb") as reader:
+                life = file_storage.load_snapshot(reader.read(), life_bytes)
+            if life is None:
+                logger.info("snapshot is stale, loading from text")
+        if life is None:
+            life = life_bytes.decode("utf-8")
+
+        if os.path.exists(journal_path):
+            with open(journal_path, "r") as reader:
+                journal_data = reader.read().decode("utf-8")
+            parser = self._life_parser(life)
+            try:
+                tokens = list(parser)
+            except LoadError as e:
+                e.error_context = parser.error_context
+                raise
+            replayed = journal.replay(tokens, life_bytes, journal_data)
+            if replayed is None:
+                logger.warning("journal doesn't match life file, ignoring it")
+            else:
+                records, log_data = replayed
+                life = file_storage.SnapshotParser(records)
+                log = files.get("log", "")
+                if isinstance(log, logstore.EventLog):
+                    log.extend(file_storage.load_log(log_data))
+                else:
+                    files["log"] = log + log_data
+
+        files["life"] = life
         self.deserialize(files)
 
     def save(self, save_dir):
-        config_path = os.path.join(save_dir, "config.json")
-        with open(config_path, "w") as writer:
-            json.dump(self.config, writer, sort_keys=True,
-                    indent=4)
+        files, write = self._prepare_save(save_dir)
+        write()
+        return files
+
+    def _prepare_save(self, save_dir, snapshot=False):
+        """
+        Do the part of a save that needs the tree. Returns the files it
+        made and a function that writes everything to save_dir, which
+        doesn't touch the tree, so it can be called later from another
+        thread (after any writes prepared before it).
+        """
+        config = json.dumps(self.config, sort_keys=True, indent=4)
+        write_log = self._prepare_log(save_dir)
+        files = {"life": file_storage.serialize_to_str(self.root)}
+        snapshot_data = None
+        if snapshot:
+            snapshot_data = file_storage.dump_snapshot(self.root,
+                    files["life"])
+
+        self._journal_root = self.root
+        self._journal_dir = save_dir
+        self._journal_checkpoint = file_storage.life_hash(
+                files["life"].encode("utf-8"))
+        self.root.changes.clear()
+
+        def write():
+            config_path = os.path.join(save_dir, "config.json")
+            with open(config_path, "w") as writer:
+                writer.write(config)
+            write_log()
+            self._save_files(save_dir, files)
+
+            # the life file now has everything the journal had
+            journal_path = os.path.join(save_dir, self.journal_filename)
+            if os.path.exists(journal_path):
+                os.remove(journal_path)
+
+            if snapshot_data is not None:
+                path = os.path.join(save_dir, self.snapshot_filename)
+                with open(path, "wb") as writer:
+                    writer.write(snapshot_data)
+        return files, write
+
+    def save_log(self, save_dir):
+        """
+        Append whatever the log store in save_dir doesn't have yet to it.
+        """
+        self._prepare_log(save_dir)()
+
+    def _prepare_log(self, save_dir):
+        log = self.root.log
+        path = os.path.join(save_dir, self.log_dirname)
+        store = log.store
+        if store is None or store.path != path:
+            store = logstore.LogStore(path)
+        write_store = log.pending_save(store)
+
+        def write():
+            write_store()
+            old_path = os.path.join(save_dir, "log")
+            if os.path.exists(old_path):
+                os.remove(old_path)
+        return write
+
+    def checkpoint(self, save_dir):
+        """
+        Full save, with a snapshot so that loading it again is fast.
+        """
+        files, write = self._prepare_save(save_dir, snapshot=True)
+        write()
+        return files
+
+    def save_journal(self, save_dir):
+        """
+        Save to save_dir by appending what changed since the last save to
+        its journal. Checkpoints instead if the tree or save_dir is not the
+        one last saved, or the journal has grown past
+        journal_checkpoint_size.
+        """
+        self._prepare_journal(save_dir)()
+
+    def _prepare_journal(self, save_dir):
+        root = self.root
+        journal_path = os.path.join(save_dir, self.journal_filename)
+        if (root is not self._journal_root
+                or save_dir != self._journal_dir
+                or root.changes.needs_checkpoint
+                or (os.path.exists(journal_path) and
+                    os.path.getsize(journal_path) >
+                    self.journal_checkpoint_size)):
+            files, write = self._prepare_save(save_dir, snapshot=True)
+            return write
+
+        write_log = self._prepare_log(save_dir)
+        batch = journal.make_batch(root, root.changes)
+        root.changes.clear()
+        if batch is None:
+            return write_log
+
+        data = journal.dump_batch(batch)
+        header = journal.header(self._journal_checkpoint)
 
-        files = self.serialize()
-        self._save_files(save_dir, files)
+        def write():
+            write_log()
+            if os.path.exists(journal_path):
+                text = data
+            else:
+                text = header + data
+            with open(journal_path, "a") as writer:
+                writer.write(text.encode("utf-8"))
+        return write
+
+    def _save_failed(self):
+        """
+        Call when a write prepared by one of the _prepare methods failed,
+        after which what's on disk is unknown: the next save starts over.
+        """
+        self._journal_root = None
+        self.root.log.forget_store()
+
+    def save_snapshot(self, save_dir, life_data):
+        """
+        Write a binary snapshot of the current tree next to life_data, which
+        must be what was just written to the life file. A partially written
+        snapshot is simply ignored by load().
+        """
+        path = os.path.join(save_dir, self.snapshot_filename)
+        with open(path, "wb") as writer:
+            writer.write(file_storage.dump_snapshot(self.root, life_data))
 
     def _save_files(self, save_dir, files):
         for filename, data in files.items():
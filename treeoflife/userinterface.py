@@ -12,6 +12,9 @@ import inspect
 import itertools
 import glob
 
+from twisted.internet import defer, threads
+from twisted.python import failure
+
 from treeoflife.file_storage import parse_line
 from treeoflife.nodes.node import nodecreator, TreeRootNode
 from treeoflife.tracker import Tracker
@@ -20,6 +23,7 @@ from treeoflife.util import tempfile, HandlerDict, Profile
 from treeoflife.parseutil import Grammar
 from treeoflife import timefmt
 from treeoflife import alarms
+from treeoflife import autosave
 
 logger = logging.getLogger(__name__)
 
@@ -252,11 +256,133 @@ class Git(object):
                 [self.binary] + list(args), cwd=self.path)
         return result == 0
 
+    def _output(self, *args):
+        process = subprocess.Popen([self.binary] + list(args),
+                cwd=self.path, stdout=subprocess.PIPE)
+        output = process.communicate()[0]
+        if process.returncode != 0:
+            return None
+        return output.decode("utf-8").strip()
+
+    def save(self, paths, message):
+        """
+        Commit paths, which may be files or directories, and which are
+        removed from the commit if they don't exist.
+        """
+        self.add(*[path for path in paths
+                if os.path.exists(os.path.join(self.path, path))])
+        self.add("--update")
+        self.commit(message)
+
+    def close(self):
+        pass
+
+
+class FastImportGit(Git):
+    """
+    Commits saves by writing them to one long lived git fast-import
+    process, rather than running git several times for each. Only files
+    that changed since the last commit through it are sent. The index
+    isn't used, so git status is off until a git reset.
+    """
+    def __init__(self, path):
+        super(FastImportGit, self).__init__(path)
+        self._process = None
+        self._mark = 0
+        # path -> (size, mtime) of files in the last commit
+        self._sent = {}
+
+    def save(self, paths, message):
+        if self._process is None:
+            self._start()
+
+        files = {}
+        deleted = set()
+        for path in paths:
+            full_path = os.path.join(self.path, path)
+            if os.path.isdir(full_path):
+                for filename in os.listdir(full_path):
+                    files[path + "/" + filename] = os.path.join(
+                            full_path, filename)
+            elif os.path.exists(full_path):
+                files[path] = full_path
+            else:
+                deleted.add(path)
+
+        self._mark += 1
+        message = message.encode("utf-8")
+        stream = [b"commit %s\n" % self._ref,
+                b"mark :%d\n" % self._mark,
+                b"committer %s now\n" % self._committer,
+                b"data %d\n%s\n" % (len(message), message)]
+        if self._from is not None:
+            stream.append(b"from %s\n" % self._from)
+            self._from = None
+
+        sent = {}
+        for path, full_path in sorted(files.items()):
+            stat = os.stat(full_path)
+            sent[path] = stat.st_size, stat.st_mtime
+            if self._sent.get(path) == sent[path]:
+                continue
+            with open(full_path, "rb") as reader:
+                data = reader.read()
+            stream.append(b"M 100644 inline %s\ndata %d\n%s\n"
+                    % (path.encode("utf-8"), len(data), data))
+        deleted.update(path for path in self._sent if path not in sent)
+        for path in sorted(deleted):
+            stream.append(b"D %s\n" % path.encode("utf-8"))
+        stream.append(b"\ncheckpoint\n\nget-mark :%d\n" % self._mark)
+
+        try:
+            self._process.stdin.write(b"".join(stream))
+            self._process.stdin.flush()
+            result = self._process.stdout.readline()
+        except EnvironmentError:
+            result = b""
+        if not result.strip():
+            self.close()
+            raise RuntimeError("git fast-import failed")
+        self._sent = sent
+
+    def _start(self):
+        self._ref = (self._output("symbolic-ref", "-q", "HEAD")
+                or "refs/heads/master").encode("utf-8")
+        if self._output("rev-parse", "-q", "--verify", self._ref):
+            self._from = self._ref + b"^0"
+        else:
+            self._from = None
+
+        name = self._output("config", "user.name") or "treeoflife-autocommit"
+        email = self._output("config", "user.email") or "treeoflife@localhost"
+        self._committer = ("%s <%s>" % (name, email)).encode("utf-8")
+
+        # git add writes loose objects, which are compressed at level 1 by
+        # default; the default for packs is much slower on a big life file
+        self._process = subprocess.Popen([self.binary,
+                "-c", "pack.compression=1", "fast-import",
+                "--quiet", "--date-format=now", "--cat-blob-fd=1"],
+                cwd=self.path, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        self._sent = {}
+
+    def close(self):
+        if self._process is None:
+            return
+        try:
+            self._process.stdin.close()
+        except EnvironmentError:
+            pass
+        self._process.wait()
+        self._process = None
+
 
 class SavingInterface(CommandInterface):
 
     # TODO: move this somewhere more sensible (it's fine here for a while)
 
+    lazy_load = True
+    git_class = FastImportGit
+
     def __init__(self, directory, main_file, use_git, **kw):
         super(SavingInterface, self).__init__(**kw)
 
@@ -267,16 +393,17 @@ class SavingInterface(CommandInterface):
 
         self.last_auto_save = None
         self.last_full_save = None
+        # whether a save is being written, and the one queued after it as
+        # [full, deferreds]
+        self._saving = False
+        self._queued_save = None
 
-        now = datetime.datetime.now()
-        self.autosave_dir = os.path.join(
-            self.save_dir,
-            now.strftime("_autosave/%Y-%m-%d/%H.%M.%S/")
-        )
+        self.autosaves = autosave.AutosaveStore(
+                os.path.join(self.save_dir, "_autosave"))
         self.autosave_minutes = datetime.timedelta(minutes=5)
 
         if use_git:
-            self.git = Git(self.save_dir)
+            self.git = self.git_class(self.save_dir)
         else:
             self.git = None
 
@@ -287,38 +414,146 @@ class SavingInterface(CommandInterface):
         return CommandInterface.load(self, self.save_dir)
 
     def save(self):
+        """
+        Full save, committed to git. Returns a Deferred that fires once it's
+        on disk. See _queue_save().
+        """
+        return self._queue_save(True)
+
+    def save_now(self):
+        """
+        Full save, done entirely on this thread, for when the reactor isn't
+        running any more.
+        """
         if self.save_dir is None:
             return
-        if not os.path.exists(self.save_dir):
-            os.makedirs(self.save_dir)
-
+        self._prepare_full_save()()
         if self.git is not None:
-            self.git.init()
+            self.git.close()
 
-        CommandInterface.save(self, self.save_dir)
+    def auto_save(self):
+        """
+        Save what changed to the journal, and every autosave_minutes, back
+        the save up to autosaves. Returns a Deferred like save().
+        """
+        return self._queue_save(False)
 
-        if self.git is not None:
-            self.git.add("config.json")
-            for filename in self.filenames:
-                self.git.add(os.path.join(self.save_dir, filename))
+    def _queue_save(self, full):
+        """
+        The tree is serialized on the reactor thread, and then written out
+        (and committed) on a worker thread, one save at a time. While one
+        is being written, the next is queued and isn't serialized until it
+        starts, so that any saves asked for meanwhile all share it; it's a
+        full save if any of them were.
+        """
+        if self.save_dir is None:
+            return defer.succeed(None)
+        if self._queued_save is None:
+            self._queued_save = [full, []]
+        elif full:
+            self._queued_save[0] = True
+        deferred = defer.Deferred()
+        self._queued_save[1].append(deferred)
+        if not self._saving:
+            self._next_save()
+        return deferred
+
+    def _next_save(self):
+        full, deferreds = self._queued_save
+        self._queued_save = None
+        self._saving = True
+        try:
+            if full:
+                write = self._prepare_full_save()
+            else:
+                write = self._prepare_auto_save()
+        except Exception:
+            result = defer.fail()
+        else:
+            result = self._defer_to_thread(write)
+
+        def done(result):
+            self._saving = False
+            if isinstance(result, failure.Failure):
+                self._save_failed()
+            for deferred in deferreds:
+                if isinstance(result, failure.Failure):
+                    deferred.errback(result)
+                else:
+                    deferred.callback(result)
+            if self._queued_save is not None and not self._saving:
+                self._next_save()
+        result.addBoth(done)
+
+    def _defer_to_thread(self, f):
+        return threads.deferToThreadPool(self._reactor,
+                self._reactor.getThreadPool(), f)
+
+    def _prepare_full_save(self):
+        files, write_files = self._prepare_save(self.save_dir, snapshot=True)
+        message = "Full save %s" % (
+                datetime.datetime.now().strftime("%A %B %d %H:%M:%S %Y"))
+        self.last_full_save = datetime.datetime.now()
 
-            self.git.gitignore(["_*"])
-            self.git.add(".gitignore")
+        def write():
+            if not os.path.exists(self.save_dir):
+                os.makedirs(self.save_dir)
 
-            self.git.commit("Full save %s" %
-                    datetime.datetime.now().strftime("%A %B %d %H:%M:%S %Y"))
-        self.last_full_save = datetime.datetime.now()
+            if self.git is not None:
+                self.git.init()
 
-    def auto_save(self):
-        if self.save_dir is None:
-            return
-        last = self.last_auto_save
-        if last and datetime.datetime.now() < last + self.autosave_minutes:
-            return
+            write_files()
 
-        if not os.path.exists(self.autosave_dir):
-            os.makedirs(self.autosave_dir)
+            if self.git is not None:
+                self.git.gitignore(["_*"])
+                # "log" is the old log file, which goes once it's in the
+                # log store
+                self.git.save(["config.json", "life", self.log_dirname,
+                    "log", ".gitignore"], message)
+        return write
 
-        CommandInterface.save(self, self.autosave_dir)
+    def _prepare_auto_save(self):
+        write_journal = self._prepare_journal(self.save_dir)
 
-        self.last_auto_save = datetime.datetime.now()
+        now = datetime.datetime.now()
+        last = self.last_auto_save
+        backup = not last or now >= last + self.autosave_minutes
+        if backup:
+            self.last_auto_save = now
+
+        def write():
+            if not os.path.exists(self.save_dir):
+                os.makedirs(self.save_dir)
+            write_journal()
+            if backup:
+                # save_dir is complete and loadable after the journal is
+                # written, so the backup is of its files rather than
+                # another serialization
+                self.autosaves.add(self.save_dir, self._autosave_paths, now)
+                self.autosaves.thin(now)
+        return write
+
+    @property
+    def _autosave_paths(self):
+        return ["life", "config.json", self.journal_filename,
+                self.log_dirname]
+
+    def restore(self, prefix=""):
+        """
+        Replace the save with the newest autosave whose name (like
+        2014-06-01T12.30.00) starts with prefix, and load it.
+        """
+        if self._saving:
+            raise InvalidInputError("a save is being written, try again")
+        name = self.autosaves.find(prefix)
+        if name is None:
+            raise InvalidInputError("no autosave matches %r" % prefix)
+
+        manifest = self.autosaves.restore(name, self.save_dir)
+        for path in self._autosave_paths + [self.snapshot_filename]:
+            full_path = os.path.join(self.save_dir, path)
+            if path not in manifest and os.path.isfile(full_path):
+                os.remove(full_path)
+        self.load()
+        logger.info("restored autosave %s", name)
+        return name